@@ -0,0 +1,184 @@
+import array
+import operator
+
+from error import Error
+
+# Numeric Arrays
+# An Array holds numbers in contiguous array.array storage: 64-bit ints
+# while every element is an int, doubles otherwise. An int that does not fit
+# in 64 bits is an error, never a silent switch to doubles. Pyrite's
+# operators work on them element by element through the dunder methods
+# below, against another Array of the same length or a single number, so one
+# expression replaces a whole loop. Comparisons give arrays of 1s and 0s.
+# Like lists, arrays are never changed in place.
+
+class Array:
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        # values: any iterable of numbers, read twice when it holds floats
+        if type(values) != list:
+            values = list(values)
+
+        try:
+            self.values = array.array("q", values)
+        except (TypeError, OverflowError):
+            # Ints only become doubles next to a float, never by growing too large
+            if all(type(value) in (int, bool) for value in values):
+                raise Error("Runtime Error", "Array integers must fit in 64 bits") from None
+
+            try:
+                self.values = array.array("d", values)
+            except (TypeError, OverflowError):
+                raise Error("Runtime Error", "Array elements must be numbers") from None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __repr__(self):
+        return f"array({self.values.tolist()})"
+
+    # Unhashable, == works element by element
+    __hash__ = None
+
+    # Operator Helpers
+
+    def operands(self, other):
+        # The other operand as something to zip with, or None when it is not a number or an Array
+        if type(other) == Array:
+            if len(other) != len(self):
+                raise Error("Runtime Error", f"Array lengths differ ({len(self)} and {len(other)})")
+
+            return other.values
+
+        if type(other) in (int, float, bool):
+            return [other] * len(self.values)
+
+        return None
+
+    def apply(self, op, other, reflected = False):
+        others = self.operands(other)
+
+        if others is None:
+            return NotImplemented
+
+        if reflected:
+            return Array(map(op, others, self.values))
+
+        return Array(map(op, self.values, others))
+
+    def divide(self, op, other, reflected = False):
+        others = self.operands(other)
+
+        if others is None:
+            return NotImplemented
+
+        divisors = self.values if reflected else others
+
+        if 0 in divisors:
+            raise Error("Zero Division Error", "Cannot divide by 0")
+
+        if reflected:
+            return Array(map(op, others, self.values))
+
+        return Array(map(op, self.values, others))
+
+    # Arithmetic Methods
+
+    def __add__(self, other):
+        return self.apply(operator.add, other)
+
+    def __radd__(self, other):
+        return self.apply(operator.add, other, True)
+
+    def __sub__(self, other):
+        return self.apply(operator.sub, other)
+
+    def __rsub__(self, other):
+        return self.apply(operator.sub, other, True)
+
+    def __mul__(self, other):
+        return self.apply(operator.mul, other)
+
+    def __rmul__(self, other):
+        return self.apply(operator.mul, other, True)
+
+    def __pow__(self, other):
+        return self.apply(operator.pow, other)
+
+    def __rpow__(self, other):
+        return self.apply(operator.pow, other, True)
+
+    def __truediv__(self, other):
+        return self.divide(operator.truediv, other)
+
+    def __rtruediv__(self, other):
+        return self.divide(operator.truediv, other, True)
+
+    def __floordiv__(self, other):
+        return self.divide(operator.floordiv, other)
+
+    def __rfloordiv__(self, other):
+        return self.divide(operator.floordiv, other, True)
+
+    def __mod__(self, other):
+        return self.divide(operator.mod, other)
+
+    def __rmod__(self, other):
+        return self.divide(operator.mod, other, True)
+
+    def __neg__(self):
+        return Array(map(operator.neg, self.values))
+
+    def __abs__(self):
+        return Array(map(abs, self.values))
+
+    # Comparison Methods
+    # Python swaps the operands itself for reflected comparisons
+
+    def __eq__(self, other):
+        return self.apply(operator.eq, other)
+
+    def __ne__(self, other):
+        return self.apply(operator.ne, other)
+
+    def __lt__(self, other):
+        return self.apply(operator.lt, other)
+
+    def __le__(self, other):
+        return self.apply(operator.le, other)
+
+    def __gt__(self, other):
+        return self.apply(operator.gt, other)
+
+    def __ge__(self, other):
+        return self.apply(operator.ge, other)
+
+# Reductions
+
+def reduce_sum(values):
+    return sum(values)
+
+def reduce_min(values):
+    if len(values) == 0:
+        raise Error("Runtime Error", "min() of an empty list")
+
+    return min(values)
+
+def reduce_max(values):
+    if len(values) == 0:
+        raise Error("Runtime Error", "max() of an empty list")
+
+    return max(values)
+
+def reduce_mean(values):
+    if len(values) == 0:
+        raise Error("Runtime Error", "mean() of an empty list")
+
+    return sum(values) / len(values)
@@ -0,0 +1,193 @@
+import io
+import os
+import sys
+import glob
+import json
+import time
+import signal
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from error import Error
+from lexer import open_source
+from vm import VM
+import run
+import parallel
+import tasks
+
+# Batch Runner
+# Runs many .pyr scripts on a pool of worker processes and writes one JSON
+# line per script: its status, result, printed output and timing, then a
+# summary line. Workers are started once, with every module imported and the
+# options applied, and run script after script; each script still gets a
+# fresh engine, so no globals leak between scripts. Parsed modules stay
+# cached in a worker, so scripts that import the same files share one parse.
+#
+# A script that runs longer than the timeout is stopped with a Timeout Error
+# between two Python operations, one long native operation finishes first.
+
+# Scripts handed to a worker at a time, more pickle less, fewer balance better
+CHUNKS_PER_WORKER = 4
+
+def find_scripts(patterns):
+    # Directories (searched recursively), globs and files, in order, each path once
+    paths = []
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*.pyr"), recursive = True)
+        else:
+            matches = glob.glob(pattern, recursive = True)
+
+        for path in sorted(matches):
+            if path.endswith(".pyr") and path not in paths:
+                paths.append(path)
+
+    return paths
+
+# Worker Side
+
+engine = "tree"
+timeout = None
+
+def warm(options):
+    # Runs once in each worker before its first script
+    global engine, timeout
+
+    engine = options["engine"]
+    timeout = options["timeout"]
+
+    run.use_cache = options["cache"]
+    run.use_optimizer = options["optimize"]
+    VM.max_depth = options["max_depth"]
+    tasks.yield_every = options["yield_every"]
+
+    # The batch already keeps every core busy
+    parallel.workers = 0
+
+    # A script waiting for input gets the end of the input, not the terminal
+    sys.stdin = open(os.devnull, "r")
+
+class Timeout(BaseException):
+    # Not an Exception, so no 'except Exception' on the way (the compiled
+    # cache, run()) can swallow it and keep the script running
+    pass
+
+def on_timeout(signum, frame):
+    raise Timeout()
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    # Only where SIGALRM exists, elsewhere scripts run without a limit
+    if not seconds or not hasattr(signal, "setitimer"):
+        yield
+        return
+
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def run_script(path):
+    record = {"script": path}
+    output = io.StringIO()
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    try:
+        run.interpreter = run.ENGINES[engine]()
+
+        with open_source(path) as text, contextlib.redirect_stdout(output):
+            try:
+                with time_limit(timeout):
+                    result = run.run(text, stream = True, path = path)
+            except Error as e:
+                # Raised outside of the script's own error handling
+                result = e
+            except Timeout:
+                result = Error("Timeout Error", f"Script ran longer than {timeout}s")
+    except OSError as e:
+        result = Error("Error", f"Failed to read file '{path}'. {e}")
+
+    record["time"] = time.perf_counter() - start
+    record["cpu"] = time.process_time() - cpu_start
+
+    if type(result) == Error:
+        record["status"] = "timeout" if result.name == "Timeout Error" else "error"
+        record["error"] = str(result)
+    else:
+        record["status"] = "ok"
+        record["result"] = str(result)
+
+    record["output"] = output.getvalue()
+
+    return record
+
+# Caller Side
+
+def run_batch(paths, options, jobs):
+    # Yields the record of each script, in the order of paths
+    if jobs == 0:
+        warm(options)
+        yield from map(run_script, paths)
+        return
+
+    chunk_size = max(1, len(paths) // (jobs * CHUNKS_PER_WORKER))
+
+    with ProcessPoolExecutor(max_workers = jobs, initializer = warm, initargs = (options,)) as pool:
+        yield from pool.map(run_script, paths, chunksize = chunk_size)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description = "Run many Pyrite scripts in worker processes, writing JSON lines")
+    arg_parser.add_argument("scripts", nargs = "+", help = "directories, globs or .pyr files to run")
+    arg_parser.add_argument("--jobs", type = int, default = os.cpu_count() or 1, help = "worker processes, 0 to run the scripts in this process")
+    arg_parser.add_argument("--timeout", type = float, help = "seconds a script may run before it is stopped")
+    arg_parser.add_argument("--engine", choices = list(run.ENGINES), default = "tree", help = "execution engine")
+    arg_parser.add_argument("--max-depth", type = int, default = VM.max_depth, help = "deepest Pyrite recursion the vm engine allows")
+    arg_parser.add_argument("--no-optimize", action = "store_true", help = "run the scripts without the optimizer pass")
+    arg_parser.add_argument("--yield-every", type = int, default = tasks.yield_every, help = "loop iterations a spawned task runs before the others get a turn, 0 for never")
+    arg_parser.add_argument("--no-cache", action = "store_true", help = "don't read or write the __pyrcache__ compiled cache")
+    args = arg_parser.parse_args()
+
+    paths = find_scripts(args.scripts)
+    options = {
+        "engine": args.engine,
+        "timeout": args.timeout,
+        "cache": not args.no_cache,
+        "optimize": not args.no_optimize,
+        "max_depth": args.max_depth,
+        "yield_every": args.yield_every
+    }
+
+    counts = {"ok": 0, "error": 0, "timeout": 0}
+    script_time = 0
+    start = time.perf_counter()
+
+    for record in run_batch(paths, options, args.jobs):
+        counts[record["status"]] += 1
+        script_time += record["time"]
+
+        print(json.dumps(record), flush = True)
+
+    summary = {
+        "scripts": len(paths),
+        "ok": counts["ok"],
+        "errors": counts["error"],
+        "timeouts": counts["timeout"],
+        "time": time.perf_counter() - start,
+        "script_time": script_time
+    }
+
+    print(json.dumps({"summary": summary}), flush = True)
+
+    if counts["ok"] != len(paths):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import glob
+import platform
+import argparse
+import statistics
+import contextlib
+
+from lexer import Lexer
+from parser import Parser
+from optimizer import Optimizer
+from run import ENGINES
+import output
+
+# Benchmark Harness
+# Times each phase of running the .pyr workloads in benchmarks/ separately:
+# lexing, parsing (with name resolution), the optimizer pass and execution.
+# Every repeat starts again from the source text with a fresh engine, and
+# the min and median of the repeats are reported per phase.
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+PHASES = ("lex", "parse", "optimize", "execute")
+
+def run_once(text, engine, optimize = True):
+    # Returns the time of each phase and the program's result
+    times = {}
+
+    start = time.perf_counter()
+    tokens = Lexer(text).tokenizer()
+    times["lex"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    statements = Parser(tokens).parse()
+    times["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if optimize:
+        statements = list(Optimizer().optimize(statements))
+    times["optimize"] = time.perf_counter() - start
+
+    interpreter = ENGINES[engine]()
+    result = None
+
+    # Workload output would only add terminal time to the measurement
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for stmt in statements:
+            result = interpreter.visit(stmt)
+        times["execute"] = time.perf_counter() - start
+
+        # Buffered exec output still goes to devnull
+        output.flush()
+
+    return times, result
+
+def bench(path, engine, repeat, optimize = True):
+    with open(path, "r") as file:
+        text = file.read()
+
+    runs = {phase: [] for phase in PHASES}
+    result = None
+
+    for _ in range(repeat):
+        times, result = run_once(text, engine, optimize)
+
+        for phase in PHASES:
+            runs[phase].append(times[phase])
+
+    phases = {}
+    for phase in PHASES:
+        phases[phase] = {
+            "min": min(runs[phase]),
+            "median": statistics.median(runs[phase]),
+            "runs": runs[phase]
+        }
+
+    return {
+        "benchmark": os.path.splitext(os.path.basename(path))[0],
+        "engine": engine,
+        "result": repr(result),
+        "phases": phases
+    }
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.3f}s"
+
+def print_result(entry, baseline = None):
+    cells = []
+
+    for phase in PHASES:
+        stats = entry["phases"][phase]
+        cell = f"{phase} {format_time(stats["min"])} / {format_time(stats["median"])}"
+
+        if baseline is not None and baseline["phases"][phase]["min"] > 0:
+            ratio = stats["min"] / baseline["phases"][phase]["min"]
+            cell += f" ({ratio:.2f}x)"
+
+        cells.append(cell)
+
+    print(f"{entry["benchmark"]:<10} {entry["engine"]:<8} " + "  ".join(cells))
+
+def load_baseline(path):
+    with open(path, "r") as file:
+        data = json.load(file)
+
+    return {(entry["benchmark"], entry["engine"]): entry for entry in data["results"]}
+
+def main():
+    arg_parser = argparse.ArgumentParser(description = "Benchmark the Pyrite lexer, parser and engines")
+    arg_parser.add_argument("names", nargs = "*", help = "benchmarks to run (default: all in benchmarks/)")
+    arg_parser.add_argument("--engine", action = "append", choices = list(ENGINES), help = "engine to time, can be repeated (default: all)")
+    arg_parser.add_argument("--repeat", type = int, default = 5, help = "runs per benchmark")
+    arg_parser.add_argument("--no-optimize", action = "store_true", help = "skip the optimizer pass")
+    arg_parser.add_argument("--json", help = "save the results to this file")
+    arg_parser.add_argument("--compare", help = "show min times relative to a saved JSON file")
+    args = arg_parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(BENCH_DIR, "*.pyr")))
+    if args.names:
+        paths = [path for path in paths if os.path.splitext(os.path.basename(path))[0] in args.names]
+
+    engines = args.engine or list(ENGINES)
+    baseline = load_baseline(args.compare) if args.compare else {}
+
+    print(f"phase min / median over {args.repeat} runs")
+
+    results = []
+    for path in paths:
+        for engine in engines:
+            entry = bench(path, engine, args.repeat, not args.no_optimize)
+            results.append(entry)
+
+            print_result(entry, baseline.get((entry["benchmark"], entry["engine"])))
+
+    if args.json:
+        data = {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+            "optimize": not args.no_optimize,
+            "results": results
+        }
+
+        with open(args.json, "w") as file:
+            json.dump(data, file, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+import marshal
+
+from tokens import *
+from error import Error
+
+# Bytecode Format
+# Every instruction is two ints in a flat list: an opcode and its argument.
+# Bump FORMAT_VERSION whenever opcodes or their encoding change.
+
+FORMAT_VERSION = 9
+
+LOAD_CONST = 0
+LOAD_NAME = 1
+STORE_NAME = 2
+STORE_OVER = 3
+STORE_CONST = 4
+POP = 5
+JUMP = 6
+JUMP_IF_FALSE = 7
+BINARY_ADD = 8
+BINARY_SUB = 9
+BINARY_MUL = 10
+BINARY_LT = 11
+BINARY_LTE = 12
+BINARY_GT = 13
+BINARY_GTE = 14
+BINARY_EQ = 15
+BINARY_NEQ = 16
+BINARY_OP = 17
+UNARY_NEG = 18
+UNARY_NOT = 19
+BUILD_LIST = 20
+INDEX = 21
+INCR = 22
+INCR_PREFIX = 23
+DECR = 24
+DECR_PREFIX = 25
+CALL_BUILTIN = 26
+CALL_FUNCTION = 27
+MAKE_FUNCTION = 28
+RETURN_VALUE = 29
+LOAD_FAST = 30
+STORE_FAST = 31
+INCR_FAST = 32
+DECR_FAST = 33
+LOAD_LOCAL = 34
+STORE_LOCAL = 35
+STORE_LOCAL_OVER = 36
+STORE_LOCAL_CONST = 37
+STEP_LOCAL = 38
+TAIL_CALL = 39
+IMPORT_NAME = 40
+SPAWN = 41
+AWAIT = 42
+
+OPNAMES = {value: name for name, value in list(globals().items()) if name.isupper() and type(value) == int and name != "FORMAT_VERSION"}
+
+# Operators without a dedicated opcode, indexed by BINARY_OP's argument
+BINARY_ORDER = (T_EXP, T_DIV, T_FDIV, T_MOD, T_AVERAGE, T_APPROX, T_AND, T_OR)
+
+BINARY_OPCODES = {
+    T_PLUS: BINARY_ADD,
+    T_MINUS: BINARY_SUB,
+    T_MUL: BINARY_MUL,
+    T_LT: BINARY_LT,
+    T_LTE: BINARY_LTE,
+    T_GT: BINARY_GT,
+    T_GTE: BINARY_GTE,
+    T_EQ: BINARY_EQ,
+    T_NEQ: BINARY_NEQ
+}
+
+# Built in functions, indexed by CALL_BUILTIN's argument
+BUILTIN_ORDER = (T_EXEC, T_INPUT, T_LEN, T_TYPE, T_STRCON, T_INTCON, T_FLOATCON, T_BOOLCON, T_ABS, T_POW,
+                 T_ARRAY, T_SUM, T_MIN, T_MAX, T_MEAN,
+                 T_RANGE, T_SORT, T_REVERSE, T_SLICE, T_CONCAT, T_BISECT, T_SEARCH, T_INDEX,
+                 T_PMAP, T_PFILTER, T_PREDUCE)
+
+# Call arguments pack an index and an argument count into one int
+ARGC_BITS = 8
+MAX_ARGS = (1 << ARGC_BITS) - 1
+
+# STEP_LOCAL packs a reference index with these flags
+STEP_DECR = 1
+STEP_PREFIX = 2
+
+class CodeObject:
+    def __init__(self, name, params = None, code = None, consts = None, names = None):
+        self.name = name
+        self.params = params or []
+        self.code = code or []
+        self.consts = consts or []
+        self.names = names or []
+
+        # Frame layout, see resolver.py
+        self.nslots = 1
+        self.param_slots = []
+        self.consts_slot = None
+        self.varnames = [""]
+
+        # Result cache size of a 'memo func', None for other functions
+        self.memo_size = None
+
+        # (depth, slot, const slot or -1, name) of locals used by the *_LOCAL opcodes
+        self.refs = []
+
+        # FunctionDefNode compiled from, kept for pmap workers but not by dump()
+        self.node = None
+
+    def to_tuple(self):
+        consts = [const.to_tuple() if type(const) == CodeObject else const for const in self.consts]
+        consts_slot = -1 if self.consts_slot is None else self.consts_slot
+        memo_size = -1 if self.memo_size is None else self.memo_size
+
+        return (self.name, tuple(self.params), tuple(self.code), tuple(consts), tuple(self.names),
+                self.nslots, tuple(self.param_slots), consts_slot, tuple(self.varnames), tuple(self.refs), memo_size)
+
+    @classmethod
+    def from_tuple(cls, data):
+        name, params, code, consts, names, nslots, param_slots, consts_slot, varnames, refs, memo_size = data
+        consts = [cls.from_tuple(const) if type(const) == tuple else const for const in consts]
+
+        code_obj = cls(name, list(params), list(code), consts, list(names))
+        code_obj.nslots = nslots
+        code_obj.param_slots = list(param_slots)
+        code_obj.consts_slot = None if consts_slot == -1 else consts_slot
+        code_obj.varnames = list(varnames)
+        code_obj.refs = list(refs)
+        code_obj.memo_size = None if memo_size == -1 else memo_size
+
+        return code_obj
+
+    def disassemble(self):
+        lines = []
+
+        for pc in range(0, len(self.code), 2):
+            op = self.code[pc]
+            arg = self.code[pc + 1]
+            lines.append(f"{pc:>5} {OPNAMES[op]:<16}{arg}")
+
+        for const in self.consts:
+            if type(const) == CodeObject:
+                lines.append("")
+                lines.append(f"func {const.name}({", ".join(const.params)})")
+                lines.append(const.disassemble())
+
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"<code {self.name}>"
+
+def dump(code_obj):
+    return marshal.dumps((FORMAT_VERSION, code_obj.to_tuple()))
+
+def load(data):
+    version, code = marshal.loads(data)
+
+    if version != FORMAT_VERSION:
+        raise Error("Runtime Error", f"Bytecode format {version} is not supported, expected {FORMAT_VERSION}")
+
+    return CodeObject.from_tuple(code)
+
+# Compiler
+# Lowers the AST into CodeObjects. Every statement and expression leaves
+# exactly one value on the stack, matching the tree-walker's results.
+
+class Compiler:
+    def __init__(self, name = "<module>", params = None):
+        self.code_obj = CodeObject(name, params)
+        self.code = self.code_obj.code
+        self.const_index = {}
+        self.name_index = {}
+        self.ref_index = {}
+
+    def compile_module(self, statements):
+        self.block(statements)
+        self.emit(RETURN_VALUE)
+
+        return self.code_obj
+
+    def compile_function(self, node):
+        # The body of a FunctionDefNode, for a Compiler made with its name and params
+        code_obj = self.code_obj
+        code_obj.nslots = node.nslots
+        code_obj.param_slots = list(node.param_slots)
+        code_obj.consts_slot = node.consts_slot
+
+        code_obj.memo_size = node.memo_size
+        code_obj.node = node
+
+        for param, slot in zip(node.params, node.param_slots):
+            self.varname(slot, param.value)
+
+        self.block(node.body)
+        self.emit(RETURN_VALUE)
+
+        return code_obj
+
+    def compile(self, node):
+        method_name = f"compile_{type(node).__name__}"
+        method = getattr(self, method_name, self.no_compile)
+
+        method(node)
+
+    def no_compile(self, node):
+        raise Error("Runtime Error", f"No visit_{type(node).__name__} method defined")
+
+    # Emit Helpers
+
+    def emit(self, op, arg = 0):
+        self.code.append(op)
+        self.code.append(arg)
+
+        return len(self.code) - 2
+
+    def patch(self, at, target = None):
+        self.code[at + 1] = len(self.code) if target is None else target
+
+    def const(self, value):
+        if type(value) == CodeObject:
+            self.code_obj.consts.append(value)
+            return len(self.code_obj.consts) - 1
+
+        # Keyed by type so 1, 1.0 and true stay distinct constants
+        key = (type(value), value)
+
+        if key not in self.const_index:
+            self.const_index[key] = len(self.code_obj.consts)
+            self.code_obj.consts.append(value)
+
+        return self.const_index[key]
+
+    def name(self, name):
+        if name not in self.name_index:
+            self.name_index[name] = len(self.code_obj.names)
+            self.code_obj.names.append(name)
+
+        return self.name_index[name]
+
+    def ref(self, node, name):
+        const_slot = getattr(node, "const_slot", None)
+        const_slot = -1 if const_slot is None else const_slot
+        key = (node.depth, node.slot, const_slot, name)
+
+        if key not in self.ref_index:
+            self.ref_index[key] = len(self.code_obj.refs)
+            self.code_obj.refs.append(key)
+
+        return self.ref_index[key]
+
+    def varname(self, slot, name):
+        varnames = self.code_obj.varnames
+
+        while len(varnames) <= slot:
+            varnames.append("")
+
+        varnames[slot] = name
+
+    def is_fast(self, node):
+        return node.depth == 0 and getattr(node, "const_slot", None) is None
+
+    def load(self, node, name):
+        if node.depth is None:
+            self.emit(LOAD_NAME, self.name(name))
+        elif node.depth == 0:
+            self.varname(node.slot, name)
+            self.emit(LOAD_FAST, node.slot)
+        else:
+            self.emit(LOAD_LOCAL, self.ref(node, name))
+
+    def store(self, node, name, op = STORE_NAME):
+        # op is the global form: STORE_NAME, STORE_OVER or STORE_CONST
+        if node.depth is None:
+            self.emit(op, self.name(name))
+        elif op == STORE_NAME and self.is_fast(node):
+            self.varname(node.slot, name)
+            self.emit(STORE_FAST, node.slot)
+        elif op == STORE_OVER:
+            self.emit(STORE_LOCAL_OVER, self.ref(node, name))
+        elif op == STORE_CONST:
+            self.emit(STORE_LOCAL_CONST, self.ref(node, name))
+        else:
+            self.emit(STORE_LOCAL, self.ref(node, name))
+
+    def step(self, node, is_decr):
+        name = node.var_name.value
+
+        if node.depth is None:
+            if is_decr:
+                self.emit(DECR_PREFIX if node.is_prefix else DECR, self.name(name))
+            else:
+                self.emit(INCR_PREFIX if node.is_prefix else INCR, self.name(name))
+        elif self.is_fast(node) and not node.is_prefix:
+            self.varname(node.slot, name)
+            self.emit(DECR_FAST if is_decr else INCR_FAST, node.slot)
+        else:
+            flags = (STEP_DECR if is_decr else 0) | (STEP_PREFIX if node.is_prefix else 0)
+            self.emit(STEP_LOCAL, (self.ref(node, name) << 2) | flags)
+
+    def pack(self, index, argc):
+        if argc > MAX_ARGS:
+            raise Error("Syntax Error", f"Too many arguments, at most {MAX_ARGS} are allowed")
+
+        return (index << ARGC_BITS) | argc
+
+    def block(self, nodes):
+        if len(nodes) == 0:
+            self.emit(LOAD_CONST, self.const(None))
+            return
+
+        for i, node in enumerate(nodes):
+            self.compile(node)
+
+            if i < len(nodes) - 1:
+                self.emit(POP)
+
+    # Variable Compile Methods
+
+    def compile_VarAssignNode(self, node):
+        self.compile(node.value)
+        self.store(node, node.var_name.value, STORE_OVER if node.is_over else STORE_NAME)
+
+    def compile_ConstAssignNode(self, node):
+        self.compile(node.value)
+        self.store(node, node.const_name.value, STORE_CONST)
+
+    def compile_VarAccessNode(self, node):
+        self.load(node, node.var_name.value)
+
+    # Conditions Compile Method
+
+    def compile_IfNode(self, node):
+        branches = [(node.condition, node.body)] + list(node.elif_clause)
+        end_jumps = []
+
+        for condition, body in branches:
+            self.compile(condition)
+            skip = self.emit(JUMP_IF_FALSE)
+            self.block(body)
+            end_jumps.append(self.emit(JUMP))
+            self.patch(skip)
+
+        if node.else_body:
+            self.block(node.else_body)
+        else:
+            self.emit(LOAD_CONST, self.const(None))
+
+        for jump in end_jumps:
+            self.patch(jump)
+
+    # Loop Compile Methods
+
+    def compile_WhileNode(self, node):
+        self.emit(LOAD_CONST, self.const(None))
+
+        loop_start = len(self.code)
+        self.compile(node.condition)
+        exit_jump = self.emit(JUMP_IF_FALSE)
+
+        if node.body:
+            self.emit(POP)
+            self.block(node.body)
+
+        self.emit(JUMP, loop_start)
+        self.patch(exit_jump)
+
+    def compile_ForNode(self, node):
+        self.compile(node.init)
+        self.store(node, node.var_name.value)
+        self.emit(POP)
+
+        loop_start = len(self.code)
+        self.compile(node.condition)
+        exit_jump = self.emit(JUMP_IF_FALSE)
+
+        for expr in node.body:
+            self.compile(expr)
+            self.emit(POP)
+
+        self.compile(node.update)
+        self.emit(POP)
+        self.emit(JUMP, loop_start)
+        self.patch(exit_jump)
+
+        self.emit(LOAD_CONST, self.const(None))
+
+    # Literal Compile Methods
+
+    def compile_LiteralNode(self, node):
+        self.emit(LOAD_CONST, self.const(node.token.value))
+
+    def compile_ListNode(self, node):
+        for element in node.elements:
+            self.compile(element)
+
+        self.emit(BUILD_LIST, len(node.elements))
+
+    def compile_ListAccessNode(self, node):
+        self.compile(node.name)
+        self.compile(node.index)
+        self.emit(INDEX)
+
+    # Function Compile Methods
+
+    def compile_FunctionDefNode(self, node):
+        code_obj = Compiler(node.name, [param.value for param in node.params]).compile_function(node)
+
+        self.emit(MAKE_FUNCTION, self.const(code_obj))
+        self.store(node, node.name)
+        self.emit(POP)
+        self.emit(LOAD_CONST, self.const(None))
+
+    def compile_FunctionCallNode(self, node):
+        func_type = node.name.type
+
+        if func_type == T_RETURN:
+            if node.args:
+                self.compile(node.args[0])
+
+                for arg in node.args[1:]:
+                    self.compile(arg)
+                    self.emit(POP)
+            else:
+                self.emit(LOAD_CONST, self.const(None))
+
+            self.emit(RETURN_VALUE)
+            return
+
+        for arg in node.args:
+            self.compile(arg)
+
+        if func_type in BUILTIN_ORDER:
+            self.emit(CALL_BUILTIN, self.pack(BUILTIN_ORDER.index(func_type), len(node.args)))
+        else:
+            self.load(node, node.name.value)
+            self.emit(TAIL_CALL if node.is_tail else CALL_FUNCTION, self.pack(self.name(node.name.value), len(node.args)))
+
+    def compile_SpawnNode(self, node):
+        call = node.call
+
+        for arg in call.args:
+            self.compile(arg)
+
+        self.load(call, call.name.value)
+        self.emit(SPAWN, self.pack(self.name(call.name.value), len(call.args)))
+
+    def compile_AwaitNode(self, node):
+        self.compile(node.value)
+        self.emit(AWAIT)
+
+    def compile_ImportNode(self, node):
+        # The names to bind are pushed as constants, a count of 0 imports every global
+        names = node.names or []
+
+        for name in names:
+            self.emit(LOAD_CONST, self.const(name))
+
+        self.emit(IMPORT_NAME, self.pack(self.name(node.module), len(names)))
+
+    def compile_IncrNode(self, node):
+        self.step(node, False)
+
+    def compile_DecrNode(self, node):
+        self.step(node, True)
+
+    # Op Compile Methods
+
+    def compile_BinOpNode(self, node):
+        self.compile(node.left)
+        self.compile(node.right)
+
+        op_type = node.op.type
+
+        if op_type in BINARY_OPCODES:
+            self.emit(BINARY_OPCODES[op_type])
+        elif op_type in BINARY_ORDER:
+            self.emit(BINARY_OP, BINARY_ORDER.index(op_type))
+        else:
+            raise Error("Runtime Error", f"Unsupported operator '{op_type}'")
+
+    def compile_UnaryOpNode(self, node):
+        self.compile(node.right)
+
+        if node.op.type == T_MINUS:
+            self.emit(UNARY_NEG)
+        elif node.op.type == T_NOT:
+            self.emit(UNARY_NOT)
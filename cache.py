@@ -0,0 +1,64 @@
+import os
+import pickle
+import hashlib
+
+# Compiled Cache
+# Stores the parsed and resolved statements of a script next to it, in
+# __pyrcache__/<name>.pyrc, so running the same unchanged script again skips
+# lexing and parsing. An entry is only used when the cache format version,
+# the source file's mtime and the hash of its text all still match.
+# Optimized statements are kept apart in <name>.opt.pyrc.
+
+CACHE_VERSION = 10
+CACHE_DIR = "__pyrcache__"
+
+def cache_path(path, optimized = False):
+    directory, file_name = os.path.split(os.path.abspath(path))
+    name, _ = os.path.splitext(file_name)
+
+    if optimized:
+        name = f"{name}.opt"
+
+    return os.path.join(directory, CACHE_DIR, f"{name}.pyrc")
+
+def source_key(path, text):
+    # text: a str, or the mapped bytes of a large source (see lexer.open_source)
+    data = text.encode("utf-8") if isinstance(text, str) else text
+    digest = hashlib.sha256(data).hexdigest()
+
+    return (CACHE_VERSION, os.stat(path).st_mtime_ns, digest)
+
+def load(path, text, optimized = False):
+    # Returns the cached statements, or None when there is no valid entry
+    try:
+        with open(cache_path(path, optimized), "rb") as file:
+            key, statements = pickle.load(file)
+    except Exception:
+        return None
+
+    if key != source_key(path, text):
+        return None
+
+    return statements
+
+def save(path, text, statements, optimized = False):
+    # A cache that cannot be written (read-only directory, ...) is skipped
+    target = cache_path(path, optimized)
+    temp = f"{target}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok = True)
+
+        with open(temp, "wb") as file:
+            pickle.dump((source_key(path, text), statements), file, pickle.HIGHEST_PROTOCOL)
+
+        # Replaced in one step so concurrent runs never read a partial file
+        os.replace(temp, target)
+    except Exception:
+        pass
+    finally:
+        # Left behind by a failed write, or one a batch timeout interrupted
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
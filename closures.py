@@ -0,0 +1,633 @@
+import operator
+
+from tokens import *
+from error import Error
+from interpreter import SymbolTable, ReturnSignal
+from runtime import UNSET, Function, Return, TailCall, BINARY_OPS, BUILTINS, list_access, counted_range, op_div, op_fdiv, op_mod
+from modules import Modules, import_module
+from output import print_line
+import tasks
+
+# Closure Compiler
+# Walks the AST once and turns every node into a specialized Python closure,
+# so running a program is a chain of direct calls with no per-node dispatch.
+# Every closure takes the current frame (None at the top level).
+
+def can_return(node):
+    # Whether running the statement can produce a Return for its block
+    node_type = type(node).__name__
+
+    if node_type == "FunctionCallNode":
+        return node.is_statement
+    if node_type == "IfNode":
+        bodies = [node.body] + [body for cond, body in node.elif_clause] + [node.else_body or []]
+        return any(can_return(expr) for body in bodies for expr in body)
+    if node_type in ("WhileNode", "ForNode"):
+        return any(can_return(expr) for expr in node.body)
+
+    return False
+
+def call_function(func, values):
+    # Runs a call, and the tail calls it hands back, to completion
+    while True:
+        try:
+            result = func.body(func.new_frame(values))
+        except ReturnSignal as rs:
+            return rs.value
+
+        if type(result) is Return:
+            result = result.value
+
+        if type(result) is not TailCall:
+            return result
+
+        func = result.func
+        values = result.args
+
+def call_memo(func, values):
+    memo = func.memo
+    key = memo.key(func, values)
+    result = memo.get(key)
+
+    if result is UNSET:
+        result = call_function(func, values)
+        memo.put(key, result)
+
+    return result
+
+class ClosureInterpreter:
+    def __init__(self):
+        self.symbol_table = SymbolTable()
+
+        # Imported modules, and the file being run to find them next to
+        self.modules = Modules()
+        self.path = None
+
+    def visit(self, node):
+        return self.compile(node)(None)
+
+    def compile(self, node):
+        method_name = f"compile_{type(node).__name__}"
+        method = getattr(self, method_name, self.no_compile)
+
+        return method(node)
+
+    def no_compile(self, node):
+        raise Error("Runtime Error", f"No visit_{type(node).__name__} method defined")
+
+    # Prepared Programs
+    # Closures are bound to the engine that compiled them, so every run
+    # compiles the statements again
+
+    def prepare(self, statements):
+        return tuple(statements)
+
+    def run_prepared(self, prepared):
+        result = None
+        for stmt in prepared:
+            result = self.visit(stmt)
+
+        return result
+
+    def compile_block(self, nodes):
+        steps = tuple(self.compile(node) for node in nodes)
+
+        if len(steps) == 0:
+            return lambda frame: None
+
+        if len(steps) == 1:
+            return steps[0]
+
+        # Only blocks holding a return statement check each step's result
+        if any(can_return(node) for node in nodes[:-1]):
+            def returning_block(frame):
+                result = None
+                for step in steps:
+                    result = step(frame)
+                    if type(result) is Return:
+                        return result
+                return result
+
+            return returning_block
+
+        def block(frame):
+            result = None
+            for step in steps:
+                result = step(frame)
+            return result
+
+        return block
+
+    # Variable Helpers
+
+    def compile_load(self, node, name):
+        # Returns a closure giving the variable's value, or UNSET when it is not defined
+        if node.depth is None:
+            symbols = self.symbol_table.symbols
+            return lambda frame: symbols.get(name, UNSET)
+
+        slot = node.slot
+
+        if node.depth == 0:
+            return lambda frame: frame[slot]
+
+        depth = node.depth
+
+        def load_outer(frame):
+            for _ in range(depth):
+                frame = frame[0]
+            return frame[slot]
+
+        return load_outer
+
+    def compile_store(self, node, name, is_const = False):
+        # Returns a closure (frame, value) that assigns the variable
+        if node.depth is None:
+            symbols = self.symbol_table.symbols
+            constants = self.symbol_table.constants
+            table = self.symbol_table
+
+            if is_const:
+                return lambda frame, value: table.set(name, value, is_const = True)
+
+            def store_global(frame, value):
+                if name in constants:
+                    raise Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+                symbols[name] = value
+
+            return store_global
+
+        slot = node.slot
+        depth = node.depth
+        const_slot = node.const_slot
+
+        if const_slot is None and depth == 0:
+            def store_fast(frame, value):
+                frame[slot] = value
+
+            return store_fast
+
+        def store_local(frame, value):
+            for _ in range(depth):
+                frame = frame[0]
+
+            if const_slot is not None:
+                consts = frame[const_slot]
+
+                if slot in consts:
+                    raise Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+                if is_const:
+                    consts.add(slot)
+
+            frame[slot] = value
+
+        return store_local
+
+    # Variable Compile Methods
+
+    def compile_VarAssignNode(self, node):
+        name = node.var_name.value
+        value = self.compile(node.value)
+        store = self.compile_store(node, name)
+
+        if node.is_over:
+            load = self.compile_load(node, name)
+
+            def over_assign(frame):
+                result = value(frame)
+
+                if load(frame) is UNSET:
+                    raise Error("Runtime Error", f"Cannot use 'over' to reassign undefined variable '{name}'")
+
+                store(frame, result)
+                return result
+
+            return over_assign
+
+        def var_assign(frame):
+            result = value(frame)
+            store(frame, result)
+            return result
+
+        return var_assign
+
+    def compile_ConstAssignNode(self, node):
+        value = self.compile(node.value)
+        store = self.compile_store(node, node.const_name.value, is_const = True)
+
+        def const_assign(frame):
+            result = value(frame)
+            store(frame, result)
+            return result
+
+        return const_assign
+
+    def compile_VarAccessNode(self, node):
+        name = node.var_name.value
+
+        if node.depth is None:
+            symbols = self.symbol_table.symbols
+
+            def global_access(frame):
+                try:
+                    return symbols[name]
+                except KeyError:
+                    raise Error("Runtime Error", f"'{name}' not defined") from None
+
+            return global_access
+
+        if node.depth == 0:
+            slot = node.slot
+
+            def fast_access(frame):
+                value = frame[slot]
+
+                if value is UNSET:
+                    raise Error("Runtime Error", f"'{name}' not defined")
+
+                return value
+
+            return fast_access
+
+        load = self.compile_load(node, name)
+
+        def local_access(frame):
+            value = load(frame)
+
+            if value is UNSET:
+                raise Error("Runtime Error", f"'{name}' not defined")
+
+            return value
+
+        return local_access
+
+    # Conditions Compile Method
+
+    def compile_IfNode(self, node):
+        branches = [(self.compile(node.condition), self.compile_block(node.body))]
+
+        for cond, body in node.elif_clause:
+            branches.append((self.compile(cond), self.compile_block(body)))
+
+        else_body = None
+        if node.else_body:
+            else_body = self.compile_block(node.else_body)
+
+        if len(branches) == 1:
+            condition, body = branches[0]
+
+            def if_single(frame):
+                if condition(frame):
+                    return body(frame)
+                if else_body is not None:
+                    return else_body(frame)
+                return None
+
+            return if_single
+
+        def if_chain(frame):
+            for condition, body in branches:
+                if condition(frame):
+                    return body(frame)
+            if else_body is not None:
+                return else_body(frame)
+            return None
+
+        return if_chain
+
+    # Loop Compile Methods
+
+    def compile_WhileNode(self, node):
+        condition = self.compile(node.condition)
+        body = tuple(self.compile(expr) for expr in node.body)
+
+        if any(can_return(expr) for expr in node.body):
+            def returning_while_loop(frame):
+                result = None
+
+                while condition(frame):
+                    for step in body:
+                        result = step(frame)
+                        if type(result) is Return:
+                            return result
+
+                return result
+
+            return returning_while_loop
+
+        def while_loop(frame):
+            result = None
+
+            while condition(frame):
+                for step in body:
+                    result = step(frame)
+
+            return result
+
+        return while_loop
+
+    def compile_ForNode(self, node):
+        init = self.compile(node.init)
+        store = self.compile_store(node, node.var_name.value)
+        condition = self.compile(node.condition)
+        update = self.compile(node.update)
+        body = tuple(self.compile(expr) for expr in node.body)
+
+        if node.counted is not None:
+            return self.compile_counted_loop(node, init, store, condition, update, body)
+
+        if any(can_return(expr) for expr in node.body):
+            def returning_for_loop(frame):
+                store(frame, init(frame))
+
+                while condition(frame):
+                    for step in body:
+                        result = step(frame)
+                        if type(result) is Return:
+                            return result
+
+                    update(frame)
+
+            return returning_for_loop
+
+        def for_loop(frame):
+            store(frame, init(frame))
+
+            while condition(frame):
+                for step in body:
+                    step(frame)
+
+                update(frame)
+
+        return for_loop
+
+    def compile_counted_loop(self, node, init, store, condition, update, body):
+        # Runs over a range when the start and bound are ints, see resolver.py
+        counted = node.counted
+        bound = self.compile(node.condition.right)
+        returns = any(can_return(expr) for expr in node.body)
+
+        def counted_loop(frame):
+            start_val = init(frame)
+            store(frame, start_val)
+
+            if type(start_val) is int:
+                bound_val = bound(frame)
+
+                if type(bound_val) is int:
+                    values = counted_range(counted, start_val, bound_val)
+
+                    for value in values:
+                        store(frame, value)
+
+                        for step in body:
+                            result = step(frame)
+                            if returns and type(result) is Return:
+                                return result
+
+                    store(frame, values.start + len(values) * values.step)
+                    return None
+
+            while condition(frame):
+                for step in body:
+                    result = step(frame)
+                    if returns and type(result) is Return:
+                        return result
+
+                update(frame)
+
+        return counted_loop
+
+    # Literal Compile Methods
+
+    def compile_LiteralNode(self, node):
+        value = node.token.value
+
+        return lambda frame: value
+
+    def compile_ListNode(self, node):
+        elements = tuple(self.compile(element) for element in node.elements)
+
+        return lambda frame: [element(frame) for element in elements]
+
+    def compile_ListAccessNode(self, node):
+        list_val = self.compile(node.name)
+        index = self.compile(node.index)
+
+        return lambda frame: list_access(list_val(frame), index(frame))
+
+    # Function Compile Methods
+
+    def compile_FunctionDefNode(self, node):
+        body = self.compile_block(node.body)
+        store = self.compile_store(node, node.name)
+
+        def function_def(frame):
+            store(frame, Function.from_node(node, body, frame, self.symbol_table))
+            return None
+
+        return function_def
+
+    def compile_FunctionCallNode(self, node):
+        args = tuple(self.compile(arg) for arg in node.args)
+        func_type = node.name.type
+
+        if func_type == T_RETURN:
+            if node.is_statement:
+                def return_statement(frame):
+                    values = [arg(frame) for arg in args]
+
+                    if len(values) > 0:
+                        return Return(values[0])
+
+                    return Return(None)
+
+                return return_statement
+
+            def return_call(frame):
+                values = [arg(frame) for arg in args]
+
+                if len(values) > 0:
+                    raise ReturnSignal(values[0])
+
+                raise ReturnSignal(None)
+
+            return return_call
+
+        if func_type == T_EXEC and len(args) == 1:
+            only = args[0]
+
+            def exec_one(frame):
+                print_line(str(only(frame)))
+                return None
+
+            return exec_one
+
+        if func_type in BUILTINS:
+            builtin = BUILTINS[func_type]
+
+            return lambda frame: builtin([arg(frame) for arg in args])
+
+        return self.compile_user_call(node, node.name.value, args)
+
+    def compile_user_call(self, node, name, args):
+        load = self.compile_load(node, name)
+
+        def user_call(frame):
+            values = [arg(frame) for arg in args]
+            func = load(frame)
+
+            if func is UNSET:
+                raise Error("Runtime Error", f"'{name}' not defined")
+
+            if type(func) != Function:
+                raise Error("Runtime Error", f"'{name}' is not a function")
+
+            if func.memo is not None:
+                return call_memo(func, values)
+
+            # call_function inlined, this is the hottest path of most programs
+            while True:
+                new_frame = func.new_frame(values)
+
+                try:
+                    result = func.body(new_frame)
+                except ReturnSignal as rs:
+                    return rs.value
+
+                if type(result) is Return:
+                    result = result.value
+
+                if type(result) is not TailCall:
+                    return result
+
+                func = result.func
+                values = result.args
+
+        if node.is_tail:
+            def tail_call(frame):
+                values = [arg(frame) for arg in args]
+                func = load(frame)
+
+                if func is UNSET:
+                    raise Error("Runtime Error", f"'{name}' not defined")
+
+                if type(func) != Function:
+                    raise Error("Runtime Error", f"'{name}' is not a function")
+
+                # A memo func has to see its result, so it is never tail called
+                if func.memo is not None:
+                    return call_memo(func, values)
+
+                return TailCall(func, values)
+
+            return tail_call
+
+        return user_call
+
+    # Task Compile Methods
+
+    def compile_SpawnNode(self, node):
+        call = node.call
+        name = call.name.value
+        args = tuple(self.compile(arg) for arg in call.args)
+        load = self.compile_load(call, name)
+
+        def spawn(frame):
+            values = [arg(frame) for arg in args]
+            return tasks.spawn(load(frame), values, name)
+
+        return spawn
+
+    def compile_AwaitNode(self, node):
+        value = self.compile(node.value)
+
+        return lambda frame: tasks.wait(value(frame))
+
+    # Import Compile Method
+
+    def compile_ImportNode(self, node):
+        return lambda frame: import_module(self, node.module, node.names)
+
+    def compile_IncrNode(self, node):
+        return self.compile_step(node, operator.add)
+
+    def compile_DecrNode(self, node):
+        # x - 1 rather than x + -1, so a wrong operand fails like on the other engines
+        return self.compile_step(node, operator.sub)
+
+    def compile_step(self, node, apply):
+        name = node.var_name.value
+        is_prefix = node.is_prefix
+        load = self.compile_load(node, name)
+        store = self.compile_store(node, name)
+
+        def step(frame):
+            current_val = load(frame)
+
+            if current_val is UNSET:
+                raise Error("Runtime Error", f"Undefined variable '{name}'")
+
+            new_val = apply(current_val, 1)
+            store(frame, new_val)
+
+            if is_prefix:
+                return new_val
+            return current_val
+
+        return step
+
+    # Bin Op Compile Method
+
+    def compile_BinOpNode(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        op_type = node.op.type
+
+        if op_type == T_PLUS:
+            return lambda frame: left(frame) + right(frame)
+        if op_type == T_MINUS:
+            return lambda frame: left(frame) - right(frame)
+        if op_type == T_MUL:
+            return lambda frame: left(frame) * right(frame)
+        if op_type == T_EXP:
+            return lambda frame: left(frame) ** right(frame)
+        if op_type == T_DIV:
+            return lambda frame: op_div(left(frame), right(frame))
+        if op_type == T_FDIV:
+            return lambda frame: op_fdiv(left(frame), right(frame))
+        if op_type == T_MOD:
+            return lambda frame: op_mod(left(frame), right(frame))
+        if op_type == T_EQ:
+            return lambda frame: left(frame) == right(frame)
+        if op_type == T_NEQ:
+            return lambda frame: left(frame) != right(frame)
+        if op_type == T_LT:
+            return lambda frame: left(frame) < right(frame)
+        if op_type == T_LTE:
+            return lambda frame: left(frame) <= right(frame)
+        if op_type == T_GT:
+            return lambda frame: left(frame) > right(frame)
+        if op_type == T_GTE:
+            return lambda frame: left(frame) >= right(frame)
+
+        if op_type in BINARY_OPS:
+            op = BINARY_OPS[op_type]
+            return lambda frame: op(left(frame), right(frame))
+
+        raise Error("Runtime Error", f"Unsupported operator '{op_type}'")
+
+    # Unary Op Compile Method
+
+    def compile_UnaryOpNode(self, node):
+        right = self.compile(node.right)
+
+        if node.op.type == T_MINUS:
+            return lambda frame: -right(frame)
+
+        if node.op.type == T_NOT:
+            return lambda frame: not right(frame)
+
+        return right
@@ -5,4 +5,8 @@ class Error(Exception):
         self.details = details
 
     def __str__(self):
-        return f"{self.name}: {self.details}"
\ No newline at end of file
+        return f"{self.name}: {self.details}"
+
+    def __reduce__(self):
+        # Rebuilt from both parts when raised in a worker process
+        return (Error, (self.name, self.details))
@@ -1,5 +1,18 @@
+import weakref
+
 from tokens import *
 from error import Error
+from runtime import UNSET, INDEX, EMPTY_CACHE, InlineCache, Function, Return, TailCall, BUILTINS, builtin_exec, builtin_input, outer_frame, counted_range
+from modules import Modules, import_module
+import tasks
+
+# BinOpNodes and ListAccessNodes the tree engine has run, for the inline cache report
+CACHE_SITES = weakref.WeakSet()
+
+# Streamed statements are dropped once they have run, with keep_sites set
+# their sites are also held here so the report at exit still has them
+keep_sites = False
+KEPT_SITES = []
 
 class SymbolTable:
     def __init__(self):
@@ -27,8 +40,16 @@ class ReturnSignal(Exception):
         self.value = value
 
 class Interpreter:
+    # Calls in tail position reuse the caller's Python stack frame
+    tail_calls = True
+
     def __init__(self):
         self.symbol_table = SymbolTable()
+        self.frame = None
+
+        # Imported modules, and the file being run to find them next to
+        self.modules = Modules()
+        self.path = None
 
     def visit(self, node):
         method_name = f"visit_{type(node).__name__}"
@@ -38,7 +59,50 @@ class Interpreter:
 
     def no_visit(self, node):
         raise Error("Runtime Error", f"No visit_{type(node).__name__} method defined")
+
+    # Prepared Programs
+    # prepare does the work that any engine of this type can reuse for every
+    # run of the statements, run_prepared runs them on a fresh engine
+
+    def prepare(self, statements):
+        return tuple(statements)
+
+    def run_prepared(self, prepared):
+        result = None
+        for stmt in prepared:
+            result = self.visit(stmt)
+
+        return result
     
+    # Variable Helpers
+
+    def lookup(self, node, name):
+        if node.depth is None:
+            if name not in self.symbol_table.symbols:
+                return UNSET
+
+            return self.symbol_table.get(name)
+
+        return outer_frame(self.frame, node.depth)[node.slot]
+
+    def assign(self, node, name, value, is_const = False):
+        if node.depth is None:
+            self.symbol_table.set(name, value, is_const)
+            return
+
+        frame = outer_frame(self.frame, node.depth)
+
+        if node.const_slot is not None:
+            consts = frame[node.const_slot]
+
+            if node.slot in consts:
+                raise Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+            if is_const:
+                consts.add(node.slot)
+
+        frame[node.slot] = value
+
     # Variable Visitor Methods
     
     def visit_VarAssignNode(self, node):
@@ -46,10 +110,10 @@ class Interpreter:
         value = self.visit(node.value)
 
         if node.is_over:
-            if var_name not in self.symbol_table.symbols:
+            if self.lookup(node, var_name) is UNSET:
                 raise Error("Runtime Error", f"Cannot use 'over' to reassign undefined variable '{var_name}'")
 
-        self.symbol_table.set(var_name, value)
+        self.assign(node, var_name, value)
 
         return value
     
@@ -57,39 +121,42 @@ class Interpreter:
         const_name = node.const_name.value
         value = self.visit(node.value)
 
-        self.symbol_table.set(const_name, value, is_const = True)
+        self.assign(node, const_name, value, is_const = True)
 
         return value
     
     def visit_VarAccessNode(self, node):
         var_name = node.var_name.value
+        value = self.lookup(node, var_name)
 
-        if var_name not in self.symbol_table.symbols:
+        if value is UNSET:
             raise Error("Runtime Error", f"'{var_name}' not defined")
 
-        return self.symbol_table.get(var_name)
+        return value
     
     # Conditions Visiter Method
 
+    def visit_block(self, nodes):
+        result = None
+
+        for expr in nodes:
+            result = self.visit(expr)
+
+            if type(result) is Return:
+                return result
+
+        return result
+
     def visit_IfNode(self, node):
         if self.visit(node.condition):
-            result = None
-            for expr in node.body:
-                result = self.visit(expr)
-            return result
+            return self.visit_block(node.body)
         
         for cond, body in node.elif_clause:
             if self.visit(cond):
-                result = None
-                for expr in body:
-                    result = self.visit(expr)
-                return result
+                return self.visit_block(body)
         
         if node.else_body:
-            result = None
-            for expr in node.else_body:
-                result = self.visit(expr)
-            return result
+            return self.visit_block(node.else_body)
         
         return None
     
@@ -101,6 +168,9 @@ class Interpreter:
         while self.visit(node.condition):
             for expr in node.body:
                 result = self.visit(expr)
+
+                if type(result) is Return:
+                    return result
         
         return result
     
@@ -108,14 +178,46 @@ class Interpreter:
         var_name = node.var_name.value
         start_val = self.visit(node.init)
 
-        self.symbol_table.set(var_name, start_val)
+        self.assign(node, var_name, start_val)
+
+        if node.counted is not None and type(start_val) is int:
+            bound = self.visit(node.condition.right)
+
+            if type(bound) is int:
+                return self.counted_loop(node, var_name, counted_range(node.counted, start_val, bound))
 
         while self.visit(node.condition):
             for expr in node.body:
-                self.visit(expr)
+                result = self.visit(expr)
+
+                if type(result) is Return:
+                    return result
 
             self.visit(node.update)
     
+    def counted_loop(self, node, var_name, values):
+        # A for loop over ints, without evaluating its condition and update
+        frame = self.frame
+        slot = node.slot
+        direct = node.depth == 0 and node.const_slot is None
+
+        for value in values:
+            if direct:
+                frame[slot] = value
+            else:
+                self.assign(node, var_name, value)
+
+            for expr in node.body:
+                result = self.visit(expr)
+
+                if type(result) is Return:
+                    return result
+
+        # Where the update would have left it, the first value failing the condition
+        self.assign(node, var_name, values.start + len(values) * values.step)
+
+        return None
+    
     # Number Visitor Method
 
     def visit_LiteralNode(self, node):
@@ -132,20 +234,17 @@ class Interpreter:
     def visit_ListAccessNode(self, node):
         list_val = self.visit(node.name)
         index = self.visit(node.index)
+        cache = node.cache
+        left_type, right_type, handler = cache.entry
 
-        if type(list_val) != list:
-            raise Error("Runtime Error", "Expected list")
-        
-        if type(index) != int:
-            raise Error("Runtime Error", "Expected index as int")
-        
-        try:
-            return list_val[index]
-        except IndexError:
-            raise Error("Runtime Error", "List index out of range")
+        if type(list_val) is left_type and type(index) is right_type:
+            cache.hits += 1
+            return handler(list_val, index)
+
+        return self.cache_miss(node, INDEX, list_val, index)
     
     def visit_FunctionDefNode(self, node):
-        self.symbol_table.set(node.name, node)
+        self.assign(node, node.name, Function.from_node(node, node.body, self.frame, self.symbol_table))
         return None
     
     def visit_FunctionCallNode(self, node):
@@ -153,34 +252,25 @@ class Interpreter:
         for arg in node.args:
             args.append(self.visit(arg))
 
+        return self.call(node, args)
+
+    def call(self, node, args):
         if node.name.type == T_RETURN:
             if len(args) > 0:
                 return_val = args[0]
             else:
                 return_val = None
 
+            if node.is_statement:
+                return Return(return_val)
+
             raise ReturnSignal(return_val)
 
         if node.name.type == T_EXEC:
-            output = "\n".join(map(str, args))
-            print(output)
-            return None
+            return builtin_exec(args)
         
         elif node.name.type == T_INPUT:
-            prompt = None
-            if args:
-                prompt = "> " + str(args[0])
-            else:
-                prompt = "> "
-
-            user = input(prompt)
-
-            if user.isdigit():
-                return int(user)
-            try:
-                return float(user)
-            except ValueError:
-                return user
+            return builtin_input(args)
             
         elif node.name.type == T_LEN:
             return len(args[0])
@@ -202,55 +292,108 @@ class Interpreter:
         
         elif node.name.type == T_POW:
             return args[0] ** args[1]
+
+        # Arrays and list functions
+        elif node.name.type in BUILTINS:
+            return BUILTINS[node.name.type](args)
         
         
-        func = self.symbol_table.get(node.name.value)
+        func_name = node.name.value
+        func = self.lookup(node, func_name)
 
-        prev_symbols = self.symbol_table.symbols.copy()
+        if func is UNSET:
+            raise Error("Runtime Error", f"'{func_name}' not defined")
 
-        for i in range(len(func.params)):
-            param_name = func.params[i].value
-            self.symbol_table.set(param_name, args[i])
+        if type(func) != Function:
+            raise Error("Runtime Error", f"'{func_name}' is not a function")
+
+        # A memo func has to see its result, so it is never tail called
+        if node.is_tail and self.tail_calls and func.memo is None:
+            return TailCall(func, args)
+
+        return self.call_function(func, args)
+
+    def call_function(self, func, args):
+        memo = func.memo
+
+        if memo is not None:
+            key = memo.key(func, args)
+            result = memo.get(key)
+
+            if result is not UNSET:
+                return result
+
+        prev_frame = self.frame
+        prev_table = self.symbol_table
 
-        result = None
         try:
-            for expr in func.body:
-                result = self.visit(expr)
+            while True:
+                # Functions imported from a module use its globals
+                self.frame = func.new_frame(args)
+                self.symbol_table = func.globals
+                result = self.visit_block(func.body)
+
+                if type(result) is Return:
+                    result = result.value
+
+                if type(result) is not TailCall:
+                    break
+
+                func = result.func
+                args = result.args
         except ReturnSignal as rs:
             result = rs.value
+        finally:
+            self.frame = prev_frame
+            self.symbol_table = prev_table
 
-        self.symbol_table.symbols = prev_symbols
+        if memo is not None:
+            memo.put(key, result)
         
         return result
+
+    # Task Visitor Methods
+
+    def visit_SpawnNode(self, node):
+        call = node.call
+        args = [self.visit(arg) for arg in call.args]
+
+        return tasks.spawn(self.lookup(call, call.name.value), args, call.name.value)
+
+    def visit_AwaitNode(self, node):
+        return tasks.wait(self.visit(node.value))
+
+    # Import Visitor Method
+
+    def visit_ImportNode(self, node):
+        return import_module(self, node.module, node.names)
     
     def visit_IncrNode(self, node):
         var_name = node.var_name.value
+        current_val = self.lookup(node, var_name)
 
-        if var_name not in self.symbol_table.symbols:
+        if current_val is UNSET:
             raise Error("Runtime Error", f"Undefined variable '{var_name}'")
 
-        current_val = self.symbol_table.get(var_name)
+        self.assign(node, var_name, current_val + 1)
 
         if node.is_prefix:
-            self.symbol_table.set(var_name, current_val + 1)
             return current_val + 1
         else:
-            self.symbol_table.set(var_name, current_val + 1)
             return current_val
     
     def visit_DecrNode(self, node):
         var_name = node.var_name.value
+        current_val = self.lookup(node, var_name)
 
-        if var_name not in self.symbol_table.symbols:
+        if current_val is UNSET:
             raise Error("Runtime Error", f"Undefined variable '{var_name}'")
 
-        current_val = self.symbol_table.get(var_name)
+        self.assign(node, var_name, current_val - 1)
 
         if node.is_prefix:
-            self.symbol_table.set(var_name, current_val - 1)
             return current_val - 1
         else:
-            self.symbol_table.set(var_name, current_val - 1)
             return current_val
     
     # Bin Op Visitor Method
@@ -258,52 +401,27 @@ class Interpreter:
     def visit_BinOpNode(self, node):
         left = self.visit(node.left)
         right = self.visit(node.right)
+        cache = node.cache
+        left_type, right_type, handler = cache.entry
 
-        if node.op.type == T_PLUS:
-            return left + right
-        elif node.op.type == T_MINUS:
-            return left - right
-        elif node.op.type == T_MUL:
-            return left * right
-        elif node.op.type == T_EXP:
-            return left ** right
-        elif node.op.type == T_DIV:
-            if right == 0:
-                raise Error("Zero Division Error", "Cannot divide by 0")
-            return left / right
-        elif node.op.type == T_FDIV:
-            if right == 0:
-                raise Error("Zero Division Error", "Cannot divide by 0")
-            return left // right
-        elif node.op.type == T_MOD:
-            if right == 0:
-                raise Error("Zero Division Error", "Cannot divide by 0")
-            return left % right
-        
-        elif node.op.type == T_AVERAGE:
-            return (left + right) / 2
-        
-        elif node.op.type == T_EQ:
-            return left == right
-        elif node.op.type == T_NEQ:
-            return left != right
-        elif node.op.type == T_LT:
-            return left < right
-        elif node.op.type == T_LTE:
-            return left <= right
-        elif node.op.type == T_GT:
-            return left > right
-        elif node.op.type == T_GTE:
-            return left >= right
-        elif node.op.type == T_APPROX:
-            return abs(left - right) <= 0.01
-        
-        elif node.op.type == T_AND:
-            return left and right
-        elif node.op.type == T_OR:
-            return left or right
-        
-        raise Error("Runtime Error", f"Unsupported operator '{node.op.type}'")
+        # The handler specialized for the operand types this site saw last
+        if type(left) is left_type and type(right) is right_type:
+            cache.hits += 1
+            return handler(left, right)
+
+        return self.cache_miss(node, node.op.type, left, right)
+
+    def cache_miss(self, node, op, left, right):
+        cache = node.cache
+
+        if cache is EMPTY_CACHE:
+            cache = node.cache = InlineCache()
+            CACHE_SITES.add(node)
+
+            if keep_sites:
+                KEPT_SITES.append(node)
+
+        return cache.update(op, left, right)(left, right)
     
     # Unary Op Visitor Method
     
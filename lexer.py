@@ -1,8 +1,19 @@
+import re
+import os
+import sys
+import mmap
+import contextlib
+
 from tokens import *
 from error import Error
 
 # Token Representation
+# Tokens are never changed once made, so the lexer shares them: one Token
+# for every operator and keyword, and one per distinct name or literal in
+# a source, with names interned.
 class Token:
+    __slots__ = ("type", "value")
+
     def __init__(self, type, value = None):
         self.type = type
         self.value = value
@@ -18,243 +29,229 @@ class Token:
             return f"{self.type}"
 
 # Lexer
+# One master regex skips any whitespace and comments and captures the text
+# of the next whole token, so re.findall splits the source in a single C
+# level pass. Comments are tried before '/' so '/#' starts a block comment,
+# and longer operators before their one character prefixes. Each lexeme is
+# then classified by a table lookup on its first character.
+TOKEN_REGEX = re.compile(r"""
+    (?:[ \t\n]+|\#[^\n]*|/\#.*?(?:\#/|\Z))*
+    (
+        [A-Za-z][A-Za-z0-9_]*
+      | ==|!=|<=|>=|~=|\+\+|--|//
+      | [0-9]+(?:\.[0-9]*)?
+      | ["'][^"']*["']
+      | .
+      | \Z
+    )
+""", re.VERBOSE | re.DOTALL)
+
+# Large files are lexed from a memory map instead of being read into a str
+# (see open_source). The same tokens over bytes: '\r' is whitespace, as
+# reading text turns it into '\n', and a non-ASCII character outside a
+# string is one illegal lexeme, not one per byte. Only the lexemes that
+# become new tokens are decoded, every other lexeme is a bytes lookup.
+BYTES_TOKEN_REGEX = re.compile(rb"""
+    (?:[ \t\r\n]+|\#[^\n]*|/\#.*?(?:\#/|\Z))*
+    (
+        [A-Za-z][A-Za-z0-9_]*
+      | ==|!=|<=|>=|~=|\+\+|--|//
+      | [0-9]+(?:\.[0-9]*)?
+      | ["'][^"']*["']
+      | [\xc0-\xff][\x80-\xbf]*
+      | .
+      | \Z
+    )
+""", re.VERBOSE | re.DOTALL)
+
+# Files at least this many bytes are memory mapped, 0 never maps
+map_threshold = 1 << 20
+
+# Bytes copied at a time to find the line of an error
+LINE_CHUNK = 1 << 20
+
+OPERATORS = {
+    "==": T_EQ,
+    "!=": T_NEQ,
+    "<=": T_LTE,
+    ">=": T_GTE,
+    "~=": T_APPROX,
+    "++": T_INCR,
+    "--": T_DECR,
+    "//": T_FDIV,
+    "=": T_ASSIGN,
+    "<": T_LT,
+    ">": T_GT,
+    "~": T_AVERAGE,
+    "&": T_AND,
+    "|": T_OR,
+    "+": T_PLUS,
+    "-": T_MINUS,
+    "*": T_MUL,
+    "^": T_EXP,
+    "/": T_DIV,
+    "%": T_MOD,
+    "(": T_LPAREN,
+    ")": T_RPAREN,
+    "{": T_LBRACE,
+    "}": T_RBRACE,
+    "[": T_LSQUARE,
+    "]": T_RSQUARE,
+    ",": T_COMMA
+}
+
+# Keywords and built in function names share one lookup
+WORDS = {**BUILTIN, **KEYWORDS}
+
+# Shared by every source
+FIXED_TOKENS = {
+    **{lexeme: Token(token_type) for lexeme, token_type in OPERATORS.items()},
+    **{word: Token(token_type, word) for word, token_type in WORDS.items()}
+}
+
+# The same, looked up by the lexeme's bytes
+FIXED_BYTE_TOKENS = {lexeme.encode(): token for lexeme, token in FIXED_TOKENS.items()}
+
+EOF_TOKEN = Token(T_EOF, None)
+
+# Lexeme class by first character
+C_WORD = 0
+C_NUMBER = 1
+C_STRING = 2
+
+CHAR_CLASS = {
+    **{char: C_WORD for char in LETTERS},
+    **{char: C_NUMBER for char in DIGITS},
+    "\"": C_STRING,
+    "'": C_STRING
+}
+
+@contextlib.contextmanager
+def open_source(path):
+    # The source of a script: a str, or a read only memory map of its bytes
+    # when the file is large. Either can be given to Lexer
+    if not map_threshold or os.path.getsize(path) < map_threshold:
+        with open(path, "r") as file:
+            yield file.read()
+        return
+
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    try:
+        yield data
+    finally:
+        try:
+            data.close()
+        except BufferError:
+            # A lexer stopped by an error still scans it, the map is
+            # released once that lexer is collected
+            pass
+
+def decode(lexeme):
+    try:
+        text = lexeme.decode("utf-8")
+    except UnicodeDecodeError:
+        raise Error("Syntax Error", "Source is not valid UTF-8") from None
+
+    # Strings read as text have their line endings turned into '\n'
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    return text
+
 class Lexer:
     def __init__(self, text):
+        # text: a str, or bytes like (bytes, mmap) holding UTF-8 source
         self.text = text
-        self.pos = -1
-        self.current_char = None
-        self.advance()
+        self.binary = not isinstance(text, str)
 
-    def advance(self):
-        self.pos += 1
+        # Byte offset of the last lexeme of a bytes stream
+        self.offset = None
 
-        if self.pos < len(self.text):
-            self.current_char = self.text[self.pos]
+    def tokenizer(self):
+        # Whole token list at once, the fastest way to lex a short source
+        regex = BYTES_TOKEN_REGEX if self.binary else TOKEN_REGEX
 
-        else:
-            self.current_char = None
+        return list(self.tokens(regex.findall(self.text)))
 
-    def tokenizer(self):
-        tokens = []
-
-        while self.current_char != None:
-
-            # Ignoring Spaces, Tabs, and Newlines
-            if self.current_char == " ":
-                self.advance()
-            elif self.current_char == "\t":
-                self.advance()
-            elif self.current_char == "\n":
-                self.advance()
-
-            # Comments
-            elif self.current_char == "#":
-                while self.current_char != None and self.current_char != "\n":
-                    self.advance()
-
-            elif self.current_char == "/" and self.peek() == "#":
-                self.advance()
-                self.advance()
-
-                while self.current_char != None:
-                    if self.current_char == "#" and self.peek() == "/":
-                        self.advance()
-                        self.advance()
-
-                        break
-                    
-                    self.advance()
-
-            # Check Digits & Letters
-            elif self.current_char in DIGITS:
-                tokens.append(self.digitizer())
-            elif self.current_char in LETTERS:
-                tokens.append(self.identifier())
-            elif self.current_char in "\"\'":
-                tokens.append(self.stringer())
-
-            # Assignment & Comparison Operators
-            elif self.current_char == "=":
-                self.advance()
-                if self.current_char == "=":
-                    tokens.append(Token(T_EQ))
-                    self.advance()
-                else:
-                    tokens.append(Token(T_ASSIGN))
-
-            elif self.current_char == "!":
-                self.advance()
-                if self.current_char == "=":
-                    tokens.append(Token(T_NEQ))
-                    self.advance()
-
-            elif self.current_char == "<":
-                self.advance()
-                if self.current_char == "=":
-                    tokens.append(Token(T_LTE))
-                    self.advance()
-                else:
-                    tokens.append(Token(T_LT))
+    def stream(self):
+        # Tokens one at a time, so only the token being parsed is kept alive
+        if self.binary:
+            return self.tokens(self.byte_lexemes())
 
-            elif self.current_char == ">":
-                self.advance()
-                if self.current_char == "=":
-                    tokens.append(Token(T_GTE))
-                    self.advance()
-                else:
-                    tokens.append(Token(T_GT))
+        return self.tokens(match.group(1) for match in TOKEN_REGEX.finditer(self.text))
 
-            elif self.current_char == "~":
-                self.advance()
-                if self.current_char == "=":
-                    tokens.append(Token(T_APPROX))
-                    self.advance()
-                else:
-                    tokens.append(Token(T_AVERAGE))
-
-            # Logical Operators
-            elif self.current_char == "&":
-                tokens.append(Token(T_AND))
-                self.advance()
-            elif self.current_char == "|":
-                tokens.append(Token(T_OR))
-                self.advance()
-            elif self.current_char == "!":
-                tokens.append(Token(T_NOT))
-                self.advance()
-
-            # Arithmetic Operators
-            elif self.current_char == "+":
-                self.advance()
-                if self.current_char == "+":
-                    tokens.append(Token(T_INCR))
-                    self.advance()
-                else:
-                    tokens.append(Token(T_PLUS))
+    def byte_lexemes(self):
+        for match in BYTES_TOKEN_REGEX.finditer(self.text):
+            self.offset = match.start(1)
+            yield match.group(1)
 
-            elif self.current_char == "-":
-                self.advance()
-                if self.current_char == "-":
-                    tokens.append(Token(T_DECR))
-                    self.advance()
-                else:
-                    tokens.append(Token(T_MINUS))
+    def located(self, statements):
+        # Statements parsed from stream(), with syntax errors in a bytes
+        # source pointing at the token the parser had reached
+        try:
+            yield from statements
+        except Error as e:
+            if e.name != "Syntax Error" or self.offset is None:
+                raise
 
-            elif self.current_char == "*":
-                tokens.append(Token(T_MUL))
-                self.advance()
+            raise Error(e.name, f"{e.details} at line {self.line()} (byte {self.offset})") from None
 
-            elif self.current_char == "^":
-                tokens.append(Token(T_EXP))
-                self.advance()
+    def line(self):
+        # Line of offset, counted a slice at a time, mmap has no count()
+        line = 1
 
-            elif self.current_char == "/":
-                self.advance()
-                if self.current_char == "/":
-                    tokens.append(Token(T_FDIV))
-                    self.advance()
-                else:
-                    tokens.append(Token(T_DIV))
-
-            elif self.current_char == "%":
-                tokens.append(Token(T_MOD))
-                self.advance()
-
-            # Brackets
-            elif self.current_char == "(":
-                tokens.append(Token(T_LPAREN))
-                self.advance()
-            elif self.current_char == ")":
-                tokens.append(Token(T_RPAREN))
-                self.advance()
-
-            elif self.current_char == "{":
-                tokens.append(Token(T_LBRACE))
-                self.advance()
-            elif self.current_char == "}":
-                tokens.append(Token(T_RBRACE))
-                self.advance()
-
-            elif self.current_char == "[":
-                tokens.append(Token(T_LSQUARE))
-                self.advance()
-            elif self.current_char == "]":
-                tokens.append(Token(T_RSQUARE))
-                self.advance()
-
-            elif self.current_char == ",":
-                tokens.append(Token(T_COMMA))
-                self.advance()
-
-            # Illegal Char Error
-            else:
-                char = self.current_char
-                self.advance()
-                
-                # raise Exception(f"Illegal Character: '{char}'")
-                raise Error("Syntax Error", f"Illegal character '{char}'")
-
-        tokens.append(Token(T_EOF, None))
-        return tokens
-    
-    def peek(self):
-        if self.pos + 1 < len(self.text):
-            return self.text[self.pos + 1]
-        
-        return None
-
-    def digitizer(self): # Making Numbers
-        num_str = ""
-        dot_count = 0
-
-        while self.current_char != None and self.current_char in DIGITS + ".":
-            if self.current_char == ".":
-                if dot_count == 1:
-                    break
-
-                dot_count += 1
-                num_str += "."
+        for start in range(0, self.offset, LINE_CHUNK):
+            line += self.text[start:min(start + LINE_CHUNK, self.offset)].count(b"\n")
 
-            else:
-                num_str += self.current_char
+        return line
 
-            self.advance()
+    def tokens(self, lexemes):
+        # lexeme -> its Token, names and literals are added as they are met
+        known = dict(FIXED_BYTE_TOKENS if self.binary else FIXED_TOKENS)
 
-        if dot_count == 0:
-            return Token(T_INT, int(num_str))
-        else:
-            return Token(T_FLOAT, float(num_str))
-        
-    def identifier(self):
-        id_str = ""
+        for lexeme in lexemes:
+            token = known.get(lexeme)
+
+            if token is not None:
+                yield token
+                continue
 
-        while self.current_char != None and self.current_char in LETTER_DIGITS + "_":
-            id_str += self.current_char
-            self.advance()
+            key = lexeme
 
-        if id_str in KEYWORDS:
-            token_type = KEYWORDS[id_str]
+            if self.binary:
+                lexeme = decode(lexeme)
 
-            return Token(token_type, id_str)
-        
-        elif id_str in BUILTIN:
-            token_type = BUILTIN[id_str]
+            char_class = CHAR_CLASS.get(lexeme[:1])
 
-            return Token(token_type, id_str)
+            if char_class == C_WORD:
+                token = Token(T_ID, sys.intern(lexeme))
 
-        return Token(T_ID, id_str)
-    
-    def stringer(self):
-        self.advance()
-        str_val = ""
+            elif char_class == C_NUMBER:
+                if "." in lexeme:
+                    token = Token(T_FLOAT, float(lexeme))
+                else:
+                    token = Token(T_INT, int(lexeme))
 
-        while self.current_char not in "\"\'":
-            if self.current_char == None:
-                raise Error("Syntax Error", "Unterminated string")
-            
-            str_val += self.current_char
-            self.advance()
+            elif char_class == C_STRING:
+                if len(lexeme) == 1:
+                    raise Error("Syntax Error", "Unterminated string")
+
+                token = Token(T_STRING, lexeme[1:-1])
+
+            # End of text
+            elif lexeme == "":
+                break
+
+            # A lone '!' is skipped, as it always has been
+            elif lexeme != "!":
+                raise Error("Syntax Error", f"Illegal character '{lexeme}'")
+
+            else:
+                continue
 
-        self.advance()
+            known[key] = token
+            yield token
 
-        return Token(T_STRING, str_val)
\ No newline at end of file
+        yield EOF_TOKEN
@@ -0,0 +1,134 @@
+import os
+
+from error import Error
+from lexer import Lexer, open_source
+from parser import Parser
+from optimizer import Optimizer
+from runtime import UNSET
+
+# Modules
+# 'import utils' runs utils.pyr and binds every global it defines, 'from
+# utils import f, g' only the names listed. A module is looked for next to
+# the file importing it, then in the working directory.
+#
+# Parsed (and optimized) statements are kept for the whole process, so every
+# importer, engine and REPL 'run' command shares one parse of each file. A
+# module runs once per engine, in its own global scope: the importing engine
+# keeps the module's SymbolTable and the functions defined in it keep using
+# it for their global names.
+
+# Set by run.py, modules are optimized like the script importing them. A
+# Program sets Modules.optimize instead, for its own runs only
+use_optimizer = True
+
+# (path, optimized) -> ((mtime_ns, size), statements)
+STATEMENTS = {}
+
+class Modules:
+    # Shared by an engine and the engines running the modules it imports
+    def __init__(self):
+        # path -> ((mtime_ns, size), SymbolTable)
+        self.tables = {}
+
+        # (path, name) of the modules being run, innermost last
+        self.loading = []
+
+        # Whether imported modules are optimized, None follows use_optimizer
+        self.optimize = None
+
+def stamp(path):
+    stat = os.stat(path)
+
+    return (stat.st_mtime_ns, stat.st_size)
+
+def find_module(engine, name):
+    directories = [os.getcwd()]
+
+    if engine.path is not None:
+        directories.insert(0, os.path.dirname(os.path.abspath(engine.path)))
+
+    for directory in directories:
+        path = os.path.join(directory, f"{name}.pyr")
+
+        if os.path.isfile(path):
+            return path
+
+    raise Error("Import Error", f"Module '{name}' not found")
+
+def load_statements(path, optimize):
+    key = (path, optimize)
+    file_stamp = stamp(path)
+    entry = STATEMENTS.get(key)
+
+    if entry is not None and entry[0] == file_stamp:
+        return entry[1]
+
+    with open_source(path) as text:
+        lexer = Lexer(text)
+
+        if lexer.binary:
+            statements = list(lexer.located(Parser(lexer.stream()).parse_stream()))
+        else:
+            statements = Parser(lexer.tokenizer()).parse()
+
+    if optimize:
+        statements = list(Optimizer().optimize(statements))
+
+    STATEMENTS[key] = (file_stamp, statements)
+
+    return statements
+
+def run_module(engine, path, name):
+    # The module's SymbolTable, running it first unless this engine already has
+    modules = engine.modules
+
+    if any(path == loading for loading, _ in modules.loading):
+        chain = " -> ".join([loading_name for _, loading_name in modules.loading] + [name])
+        raise Error("Import Error", f"Circular import of '{name}' ({chain})")
+
+    file_stamp = stamp(path)
+    entry = modules.tables.get(path)
+
+    if entry is not None and entry[0] == file_stamp:
+        return entry[1]
+
+    optimize = modules.optimize if modules.optimize is not None else use_optimizer
+    statements = load_statements(path, optimize)
+
+    module = type(engine)()
+    module.modules = modules
+    module.path = path
+
+    modules.loading.append((path, name))
+
+    try:
+        for stmt in statements:
+            module.visit(stmt)
+    finally:
+        modules.loading.pop()
+
+    modules.tables[path] = (file_stamp, module.symbol_table)
+
+    return module.symbol_table
+
+def import_module(engine, name, names = None):
+    table = run_module(engine, find_module(engine, name), name)
+    symbols = table.symbols
+
+    # Python's own __builtins__ entry of the python engine is not a Pyrite name
+    if names is None:
+        names = [symbol for symbol in symbols if not symbol.startswith("__")]
+
+    for symbol in names:
+        if symbol not in symbols:
+            raise Error("Import Error", f"Module '{name}' has no '{symbol}'")
+
+        value = symbols[symbol]
+
+        # Importing again, from another run in the REPL, is not a reassignment
+        if engine.symbol_table.symbols.get(symbol, UNSET) is value:
+            continue
+
+        engine.symbol_table.set(symbol, value, table.is_constant(symbol))
+
+    return None
@@ -0,0 +1,299 @@
+import math
+
+from tokens import *
+from lexer import Token
+from parser import LiteralNode, IfNode, WhileNode
+from runtime import BINARY_OPS
+from resolver import loop_shape
+
+# Optimizer
+# Rewrites resolved statements before they run:
+# - operators whose operands are all literals are folded into one literal
+# - if branches with a literal condition are dropped or made unconditional
+# - loops with a falsy literal condition lose their body
+# - x * 1, x + 0, x - 0, x ^ 1 and x / 1 become x when x is known to be a number
+#
+# Anything that would raise (1 / 0, "a" - 1, ...) is left as it is, so the
+# error is still reported by the engine at the moment it happens. Literal
+# truthiness is Python's: 'true' and 'false' are the strings "true" and
+# "false", so only 0, 0.0, "" and folded comparisons count as false.
+
+# Folded strings and ints larger than this are left to be built at run time
+MAX_FOLD_SIZE = 4096
+
+def is_literal(node):
+    return type(node) == LiteralNode
+
+def make_literal(value):
+    if type(value) == bool:
+        return LiteralNode(Token(T_BOOL, value))
+    if type(value) == int:
+        return LiteralNode(Token(T_INT, value))
+    if type(value) == float:
+        return LiteralNode(Token(T_FLOAT, value))
+
+    return LiteralNode(Token(T_STRING, value))
+
+def foldable(value):
+    # Values that are safe to bake into every engine's constants
+    if type(value) == int:
+        return value.bit_length() <= MAX_FOLD_SIZE
+    if type(value) == float:
+        # -0.0 compares equal to 0.0 and would be merged with it as a constant
+        return math.isfinite(value) and not (value == 0 and math.copysign(1, value) < 0)
+    if type(value) == str:
+        return len(value) <= MAX_FOLD_SIZE
+
+    return type(value) == bool
+
+def too_costly(op_type, left, right):
+    # Operations whose result would be too large to compute at parse time
+    if op_type == T_EXP and type(left) == int and type(right) == int:
+        return right > MAX_FOLD_SIZE or left.bit_length() * right > MAX_FOLD_SIZE
+
+    if op_type == T_MUL and type(right) == str:
+        left, right = right, left
+
+    if op_type == T_MUL and type(left) == str and type(right) == int:
+        return len(left) * right > MAX_FOLD_SIZE
+
+    return False
+
+class Optimizer:
+    def optimize(self, statements):
+        # Top level statements are optimized one at a time so streamed
+        # programs stay streamed. Each one is treated as a block's last value
+        for node in statements:
+            yield from self.optimize_block([node])
+
+    def visit(self, node):
+        method = getattr(self, f"optimize_{type(node).__name__}", None)
+
+        if method is None:
+            return node
+
+        return method(node)
+
+    def optimize_block(self, nodes):
+        statements = []
+
+        for i in range(len(nodes)):
+            is_last = i == len(nodes) - 1
+            statements.extend(self.optimize_statement(self.visit(nodes[i]), is_last))
+
+        return statements
+
+    def optimize_statement(self, node, is_last):
+        # A block's value is its last statement's value, so statements with no
+        # effect can only be dropped when they are not last
+        if type(node) == IfNode and is_literal(node.condition):
+            body = node.body if node.condition.token.value else node.else_body or []
+
+            # Blocks don't open a scope, so the body that always runs can
+            # take the place of the if
+            if body:
+                return body
+
+            return [node] if is_last else []
+
+        if type(node) == WhileNode and is_literal(node.condition) and not node.condition.token.value:
+            return [node] if is_last else []
+
+        if is_literal(node) and not is_last:
+            return []
+
+        return [node]
+
+    # Type Helpers
+
+    def number_type(self, node):
+        # int or float when the node can only evaluate to that type, else None
+        node_type = type(node).__name__
+
+        if node_type == "LiteralNode":
+            if type(node.token.value) in (int, float):
+                return type(node.token.value)
+
+        elif node_type == "UnaryOpNode" and node.op.type in (T_PLUS, T_MINUS):
+            return self.number_type(node.right)
+
+        elif node_type == "BinOpNode" and node.op.type in (T_PLUS, T_MINUS, T_MUL, T_FDIV, T_MOD):
+            left = self.number_type(node.left)
+            right = self.number_type(node.right)
+
+            if left is not None and right is not None:
+                return int if left == right == int else float
+
+        elif node_type == "FunctionCallNode":
+            if node.name.type in (T_LEN, T_INTCON, T_BISECT, T_SEARCH, T_INDEX):
+                return int
+            if node.name.type == T_FLOATCON:
+                return float
+            if node.name.type == T_ABS and len(node.args) == 1:
+                return self.number_type(node.args[0])
+
+        return None
+
+    def is_value(self, node, value):
+        return is_literal(node) and type(node.token.value) == int and node.token.value == value
+
+    # Operator Optimize Methods
+
+    def optimize_BinOpNode(self, node):
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        op_type = node.op.type
+
+        if is_literal(node.left) and is_literal(node.right):
+            left = node.left.token.value
+            right = node.right.token.value
+
+            if op_type in BINARY_OPS and not too_costly(op_type, left, right):
+                try:
+                    value = BINARY_OPS[op_type](left, right)
+                except Exception:
+                    return node
+
+                if foldable(value):
+                    return make_literal(value)
+
+            return node
+
+        return self.simplify(node)
+
+    def simplify(self, node):
+        op_type = node.op.type
+        left = node.left
+        right = node.right
+
+        if op_type == T_MUL:
+            if self.is_value(right, 1) and self.number_type(left) is not None:
+                return left
+            if self.is_value(left, 1) and self.number_type(right) is not None:
+                return right
+
+        # -0.0 + 0 is 0.0, so adding zero is only an identity for ints
+        if op_type == T_PLUS:
+            if self.is_value(right, 0) and self.number_type(left) == int:
+                return left
+            if self.is_value(left, 0) and self.number_type(right) == int:
+                return right
+
+        if op_type == T_MINUS and self.is_value(right, 0) and self.number_type(left) is not None:
+            return left
+
+        if op_type == T_EXP and self.is_value(right, 1) and self.number_type(left) is not None:
+            return left
+
+        # An int divided by 1 becomes a float
+        if op_type == T_DIV and self.is_value(right, 1) and self.number_type(left) == float:
+            return left
+
+        return node
+
+    def optimize_UnaryOpNode(self, node):
+        node.right = self.visit(node.right)
+
+        if node.op.type == T_PLUS:
+            return node.right
+
+        if is_literal(node.right) and node.op.type in (T_MINUS, T_NOT):
+            try:
+                if node.op.type == T_MINUS:
+                    value = -node.right.token.value
+                else:
+                    value = not node.right.token.value
+            except Exception:
+                return node
+
+            if foldable(value):
+                return make_literal(value)
+
+        return node
+
+    # Conditions Optimize Method
+
+    def optimize_IfNode(self, node):
+        branches = [(node.condition, node.body)] + list(node.elif_clause)
+        kept = []
+        else_body = node.else_body
+
+        for cond, body in branches:
+            cond = self.visit(cond)
+
+            if is_literal(cond):
+                if not cond.token.value:
+                    continue
+
+                # Always taken: nothing after this branch can run
+                if not kept:
+                    return IfNode(cond, self.optimize_block(body))
+
+                else_body = body
+                break
+
+            kept.append((cond, self.optimize_block(body)))
+
+        if else_body:
+            else_body = self.optimize_block(else_body)
+
+        if not kept:
+            # No condition can be true, only the else body is left
+            return IfNode(make_literal(0), [], else_body = else_body)
+
+        return IfNode(kept[0][0], kept[0][1], kept[1:], else_body)
+
+    # Loop Optimize Methods
+
+    def optimize_WhileNode(self, node):
+        node.condition = self.visit(node.condition)
+
+        if is_literal(node.condition) and not node.condition.token.value:
+            node.body = []
+        else:
+            node.body = self.optimize_block(node.body)
+
+        return node
+
+    def optimize_ForNode(self, node):
+        node.init = self.visit(node.init)
+        node.condition = self.visit(node.condition)
+        node.update = self.visit(node.update)
+        node.body = self.optimize_block(node.body)
+
+        # Folding keeps the bound pure, but the loop has to keep its shape
+        if node.counted is not None:
+            node.counted = loop_shape(node)
+
+        return node
+
+    # Variable Optimize Methods
+
+    def optimize_VarAssignNode(self, node):
+        node.value = self.visit(node.value)
+        return node
+
+    def optimize_ConstAssignNode(self, node):
+        node.value = self.visit(node.value)
+        return node
+
+    # Literal Optimize Methods
+
+    def optimize_ListNode(self, node):
+        node.elements = [self.visit(element) for element in node.elements]
+        return node
+
+    def optimize_ListAccessNode(self, node):
+        node.name = self.visit(node.name)
+        node.index = self.visit(node.index)
+        return node
+
+    # Function Optimize Methods
+
+    def optimize_FunctionDefNode(self, node):
+        node.body = self.optimize_block(node.body)
+        return node
+
+    def optimize_FunctionCallNode(self, node):
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
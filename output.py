@@ -0,0 +1,146 @@
+import sys
+import time
+import atexit
+import threading
+import contextlib
+
+# Output
+# exec() writes through the current sink instead of printing each line, so
+# a loop producing lots of output costs a list append per line rather than
+# a write to the terminal. Three sinks are built in:
+#   StreamSink: buffers and writes to stdout (or another stream) once
+#               buffer_size characters are waiting. With an interval, a
+#               timer thread also writes what is waiting every interval
+#               seconds, so output shows up during long computations.
+#               buffer_size 0 writes every line straight away, for
+#               interactive use.
+#   CaptureSink: keeps everything in memory, for embedding Pyrite.
+#   FileSink: writes to a file.
+#
+# run() flushes at the end of every script and before reading input, so
+# output never appears after a later prompt, result or error message.
+#
+# set_sink() replaces the sink for the whole process, use() only for the
+# current thread, so programs run by several threads at once (see
+# program.py) each collect their own output.
+
+class StreamSink:
+    def __init__(self, stream = None, buffer_size = 65536, interval = None):
+        # stream None writes to sys.stdout as it is when flushing
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.parts = []
+        self.size = 0
+        self.closed = False
+
+        # Keeps the timer and the writing thread from flushing out of order
+        self.lock = threading.Lock()
+
+        if interval is not None:
+            threading.Thread(target = self.flush_every, daemon = True).start()
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            stream = self.stream or sys.stdout
+
+            # Swapped before joining, a line appended meanwhile is still in parts
+            parts = self.parts
+
+            if parts:
+                self.parts = []
+                self.size = 0
+                stream.write("".join(parts))
+
+            stream.flush()
+
+    def flush_every(self):
+        while not self.closed:
+            time.sleep(self.interval)
+
+            if self.parts and not self.closed:
+                self.flush()
+
+    def close(self):
+        self.flush()
+        self.closed = True
+
+class CaptureSink:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+    def lines(self):
+        return self.getvalue().splitlines()
+
+class FileSink:
+    def __init__(self, path, buffer_size = 65536, mode = "w"):
+        self.file = open(path, mode, buffering = buffer_size)
+
+    def write(self, text):
+        self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+sink = StreamSink()
+
+# Sink of the current thread while use() is active
+local = threading.local()
+
+def current():
+    return getattr(local, "sink", None) or sink
+
+def print_line(text):
+    current().write(text + "\n")
+
+def flush():
+    current().flush()
+
+def set_sink(new_sink):
+    # Returns the previous sink, flushed, the caller decides whether to close it
+    global sink
+
+    previous = sink
+    previous.flush()
+    sink = new_sink
+
+    return previous
+
+@contextlib.contextmanager
+def use(new_sink):
+    # with output.use(CaptureSink()) as captured: ..., for this thread only
+    current().flush()
+
+    previous = getattr(local, "sink", None)
+    local.sink = new_sink
+
+    try:
+        yield new_sink
+    finally:
+        new_sink.flush()
+        local.sink = previous
+
+# Buffered output still reaches the terminal when the program exits
+atexit.register(lambda: sink.close())
@@ -0,0 +1,218 @@
+import io
+import os
+import math
+import pickle
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from tokens import T_ID
+from error import Error
+from resolver import children
+import output
+
+# Parallel Map
+# pmap, pfilter and preduce run a Pyrite function over a list in a pool of
+# worker processes. The function is pickled with what it captures: its
+# closure frames and the globals that it, or a function it reaches, names.
+# Functions are rebuilt in the workers from their definitions as tree
+# engine functions, the closure and python engines compile them to Python
+# closures, which cannot be pickled. The python engine keeps no frames for
+# nested functions, so only top level ones can be sent from it. The list is
+# split into chunks, a few per worker, so uneven calls still balance without
+# pickling every element on its own.
+#
+# Workers run on copies of the globals, changes they make are not seen by
+# the caller or by each other.
+
+# Worker processes to use, 0 runs the chunks in this process instead
+workers = os.cpu_count() or 1
+
+# Chunks per worker, more balance uneven work better, fewer pickle less
+CHUNKS_PER_WORKER = 4
+
+pool = None
+pool_size = 0
+
+def get_pool():
+    global pool, pool_size
+
+    if pool is None or pool_size != workers:
+        if pool is not None:
+            pool.shutdown()
+
+        pool = ProcessPoolExecutor(max_workers = workers)
+        pool_size = workers
+
+    return pool
+
+def chunks(values):
+    size = max(1, math.ceil(len(values) / (max(workers, 1) * CHUNKS_PER_WORKER)))
+
+    return [values[start:start + size] for start in range(0, len(values), size)]
+
+# Payloads
+
+def global_names(node):
+    # Global names a function definition, or one nested in it, reads or writes
+    names = set()
+    pending = list(node.body)
+
+    while pending:
+        child = pending.pop()
+        child_type = type(child).__name__
+        name = None
+
+        if child_type == "FunctionDefNode":
+            pending.extend(child.body)
+            name = child.name
+        elif child_type == "FunctionCallNode":
+            if child.name.type == T_ID:
+                name = child.name.value
+        elif child_type == "ConstAssignNode":
+            name = child.const_name.value
+        elif hasattr(child, "var_name"):
+            name = child.var_name.value
+
+        if name is not None and getattr(child, "depth", 0) is None:
+            names.add(name)
+
+        pending.extend(children(child))
+
+    return names
+
+def captured_globals(func):
+    # id(SymbolTable) -> names of it that func can reach, through the
+    # functions it names and the values in its closure frames
+    captured = {}
+    pending = [func]
+    seen = set()
+
+    while pending:
+        value = pending.pop()
+
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+
+        # Lists and closure frames alike
+        if type(value) == list:
+            pending.extend(value)
+            continue
+
+        if type(value).__name__ != "Function" or value.node is None or value.globals is None:
+            continue
+
+        pending.append(value.closure)
+
+        symbols = value.globals.symbols
+        names = captured.setdefault(id(value.globals), set())
+
+        for name in global_names(value.node):
+            if name in symbols and name not in names:
+                names.add(name)
+                pending.append(symbols[name])
+
+    return captured
+
+class PayloadPickler(pickle.Pickler):
+    # Pickles each SymbolTable with only the captured names
+    def __init__(self, file, captured):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.captured = captured
+
+    def reducer_override(self, obj):
+        if type(obj).__name__ != "SymbolTable":
+            return NotImplemented
+
+        names = self.captured.get(id(obj), set())
+        state = {
+            "symbols": {name: obj.symbols[name] for name in names},
+            "constants": obj.constants & names
+        }
+
+        return (type(obj), (), state)
+
+def dump_payload(func):
+    file = io.BytesIO()
+    PayloadPickler(file, captured_globals(func)).dump(func)
+
+    return file.getvalue()
+
+# Worker Side
+
+# The function of the last payload, chunks of one call mostly land on the same worker
+last_payload = None
+last_function = None
+
+def load_function(payload):
+    global last_payload, last_function
+
+    if payload != last_payload:
+        last_function = pickle.loads(payload)
+        last_payload = payload
+
+    return last_function
+
+def run_chunk(payload, mode, chunk):
+    # Imported here, the interpreter imports runtime, which imports this module
+    from interpreter import Interpreter
+
+    func = load_function(payload)
+    engine = Interpreter()
+
+    try:
+        if mode == "map":
+            return [engine.call_function(func, [value]) for value in chunk]
+
+        if mode == "filter":
+            return [value for value in chunk if engine.call_function(func, [value])]
+
+        result = chunk[0]
+        for value in chunk[1:]:
+            result = engine.call_function(func, [result, value])
+
+        return result
+    except RecursionError:
+        raise Error("Runtime Error", "Maximum recursion depth exceeded in a worker process") from None
+    finally:
+        # Worker processes exit without running atexit, so exec output is flushed per chunk
+        output.flush()
+
+# Caller Side
+
+def run_parallel(name, func, values, mode):
+    # The per chunk results of func over values, in order
+    try:
+        payload = dump_payload(func)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        raise Error("Runtime Error", f"{name}() cannot send '{func.name}' to worker processes: {e}") from None
+
+    parts = chunks(values)
+
+    if workers == 0:
+        return payload, [run_chunk(payload, mode, chunk) for chunk in parts]
+
+    # Output from before the call comes before the workers' own
+    output.flush()
+
+    return payload, list(get_pool().map(run_chunk, itertools.repeat(payload), itertools.repeat(mode), parts))
+
+def pmap(func, values):
+    _, results = run_parallel("pmap", func, values, "map")
+
+    return list(itertools.chain.from_iterable(results))
+
+def pfilter(func, values):
+    _, results = run_parallel("pfilter", func, values, "filter")
+
+    return list(itertools.chain.from_iterable(results))
+
+def preduce(func, values):
+    # Chunks are reduced in the workers and their results here, so func has
+    # to be associative: (a, b) then c must equal a then (b, c)
+    if not values:
+        raise Error("Runtime Error", "preduce() of an empty list with no initial value")
+
+    payload, results = run_parallel("preduce", func, values, "reduce")
+
+    return run_chunk(payload, "reduce", results)
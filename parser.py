@@ -1,8 +1,16 @@
 from tokens import *
 from error import Error
+from resolver import Resolver
+from runtime import MEMO_SIZE, EMPTY_CACHE
 
+# Nodes are slotted: a large program is mostly nodes, and without a
+# __dict__ each one takes a fraction of the memory. Nodes that are kept in
+# weak collections (inline cache sites, compiled functions) also get a
+# __weakref__ slot.
 
 class LiteralNode:
+    __slots__ = ("token",)
+
     def __init__(self, token):
         self.token = token
 
@@ -10,6 +18,8 @@ class LiteralNode:
         return f"{self.token}"
     
 class ListNode:
+    __slots__ = ("elements",)
+
     def __init__(self, elements):
         self.elements = elements
 
@@ -17,23 +27,31 @@ class ListNode:
         return f"[{", ".join(self.elements)}]"
     
 class ListAccessNode:
+    __slots__ = ("name", "index", "cache", "__weakref__")
+
     def __init__(self, name, index):
         self.name = name
         self.index = index
+        self.cache = EMPTY_CACHE
 
     def __repr__(self):
         return f"{self.name}[{self.index}]"
 
 class BinOpNode:
+    __slots__ = ("left", "op", "right", "cache", "__weakref__")
+
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
+        self.cache = EMPTY_CACHE
 
     def __repr__(self):
         return f"({self.left}, {self.op}, {self.right})"
     
 class UnaryOpNode:
+    __slots__ = ("op", "right")
+
     def __init__(self, op, right):
         self.op = op
         self.right = right
@@ -42,48 +60,84 @@ class UnaryOpNode:
         return f"({self.op}, {self.right})"
     
 class IncrNode:
+    __slots__ = ("var_name", "is_prefix", "depth", "slot", "const_slot")
+
     def __init__(self, var_name, is_prefix = False):
         self.var_name = var_name
         self.is_prefix = is_prefix
 
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+        self.const_slot = None
+
     def __repr__(self):
         return f"{self.var_name}++"
     
 class DecrNode:
+    __slots__ = ("var_name", "is_prefix", "depth", "slot", "const_slot")
+
     def __init__(self, var_name, is_prefix = False):
         self.var_name = var_name
         self.is_prefix = is_prefix
 
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+        self.const_slot = None
+
     def __repr__(self):
         return f"{self.var_name}--"
     
 # Variable Nodes
 class VarAccessNode:
+    __slots__ = ("var_name", "depth", "slot")
+
     def __init__(self, var_name):
         self.var_name = var_name
 
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+
     def __repr__(self):
         return f"{self.var_name}"
     
 class VarAssignNode:
+    __slots__ = ("var_name", "value", "is_over", "depth", "slot", "const_slot")
+
     def __init__(self, var_name, value, is_over = False):
         self.var_name = var_name
         self.value = value
         self.is_over = is_over
 
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+        self.const_slot = None
+
     def __repr__(self):
         return f"({self.var_name} = {self.value})"
     
 class ConstAssignNode:
+    __slots__ = ("const_name", "value", "depth", "slot", "const_slot")
+
     def __init__(self, const_name, value):
         self.const_name = const_name
         self.value = value
 
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+        self.const_slot = None
+
     def __repr__(self):
         return f"({self.const_name} = {self.value})"
 
 # Conditions Nodes
 class IfNode:
+    __slots__ = ("condition", "body", "elif_clause", "else_body")
+
     def __init__(self, condition, body, elif_clause = None, else_body = None):
         self.condition = condition
         self.body = body
@@ -105,6 +159,8 @@ class IfNode:
     
 # Loop Nodes
 class WhileNode:
+    __slots__ = ("condition", "body")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
@@ -113,6 +169,8 @@ class WhileNode:
         return f"(while {self.condition} {{ {self.body} }})"
     
 class ForNode:
+    __slots__ = ("var_name", "init", "condition", "update", "body", "depth", "slot", "const_slot", "counted")
+
     def __init__(self, var_name, init, condition, update, body):
         self.var_name = var_name
         self.init = init
@@ -120,51 +178,127 @@ class ForNode:
         self.update = update
         self.body = body
 
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+        self.const_slot = None
+
+        # Filled in by the resolver: (step, comparison) of a counted loop
+        self.counted = None
+
     def __repr__(self):
         return f"(for {self.var_name} = {self.init} as {self.condition} do {self.update} {{ {self.body} }})"
    
 # Function Node
 class FunctionDefNode:
-    def __init__(self, name, params, body):
+    __slots__ = ("name", "params", "body", "memo_size", "depth", "slot", "const_slot", "nslots", "param_slots", "consts_slot", "__weakref__")
+
+    def __init__(self, name, params, body, memo_size = None):
         self.name = name
         self.params = params
         self.body = body
 
+        # Size of the result cache of a 'memo func', None for other functions
+        self.memo_size = memo_size
+
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+        self.const_slot = None
+
+        # Frame layout of the function's own scope
+        self.nslots = 1
+        self.param_slots = []
+        self.consts_slot = None
+
     def __repr__(self):
         return f"(func {self.name}({self.params}) {{ {self.body} }})"
     
 class FunctionCallNode:
+    __slots__ = ("name", "args", "depth", "slot", "is_statement", "is_tail")
+
     def __init__(self, name, args):
         self.name = name
         self.args = args
 
+        # Filled in by the resolver: frame depth and slot, None for globals
+        self.depth = None
+        self.slot = None
+
+        # Filled in by the resolver: a return that is a statement of its
+        # function's body, or a call whose value is the function's result
+        self.is_statement = False
+        self.is_tail = False
+
     def __repr__(self):
         return f"{self.name.value}({", ".join(map(str, self.args))})"
     
+# Task Nodes
+class SpawnNode:
+    __slots__ = ("call",)
+
+    def __init__(self, call):
+        # FunctionCallNode of the user function to start as a task
+        self.call = call
+
+    def __repr__(self):
+        return f"(spawn {self.call})"
+
+class AwaitNode:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f"(await {self.value})"
+
+# Import Node
+class ImportNode:
+    __slots__ = ("module", "names")
+
+    def __init__(self, module, names = None):
+        self.module = module
+
+        # Names listed after 'from module import', None to import every global
+        self.names = names
+
+    def __repr__(self):
+        if self.names is None:
+            return f"(import {self.module})"
+
+        return f"(from {self.module} import {", ".join(self.names)})"
+    
 
 class Parser:
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.index = -1
+        # Any iterable of tokens, a list or a Lexer stream. The parser only
+        # ever looks one token ahead, so it holds nothing but current_token
+        self.tokens = iter(tokens)
         self.current_token = None
         self.advance()
 
     def advance(self):
-        self.index += 1
-
-        if self.index < len(self.tokens):
-            self.current_token = self.tokens[self.index]
+        # Stays on the last token (EOF) once the tokens run out
+        self.current_token = next(self.tokens, self.current_token)
 
         return self.current_token
 
     def parse(self):
-        expr = self.statements()
+        return list(self.parse_stream())
+
+    def parse_stream(self):
+        # Yields each top level statement as soon as it is parsed. Top level
+        # names are globals, so statements can be resolved one at a time
+        while self.current_token.type not in (T_RBRACE, T_EOF):
+            if self.current_token.type in (T_IMPORT, T_FROM):
+                yield self.import_statement()
+            else:
+                yield Resolver().resolve([self.expr()])[0]
 
         if self.current_token.type != T_EOF:
             raise Error("Syntax Error", f"Unexpected token '{self.current_token}'")
 
-        return expr
-
     def factor(self):
         token = self.current_token
 
@@ -186,7 +320,10 @@ class Parser:
             return self.list_expr()
         
         # Built In Functions
-        if token.type in (T_RETURN, T_EXEC, T_INPUT, T_LEN, T_TYPE, T_STRCON, T_INTCON, T_FLOATCON, T_BOOLCON, T_ABS, T_POW):
+        if token.type in (T_RETURN, T_EXEC, T_INPUT, T_LEN, T_TYPE, T_STRCON, T_INTCON, T_FLOATCON, T_BOOLCON, T_ABS, T_POW,
+                          T_ARRAY, T_SUM, T_MIN, T_MAX, T_MEAN,
+                          T_RANGE, T_SORT, T_REVERSE, T_SLICE, T_CONCAT, T_BISECT, T_SEARCH, T_INDEX,
+                          T_PMAP, T_PFILTER, T_PREDUCE):
             func_token = token
             self.advance()
 
@@ -198,6 +335,21 @@ class Parser:
 
             return FunctionCallNode(func_token, args)
         
+        # Tasks
+        if token.type == T_SPAWN:
+            self.advance()
+            func_token = self.expect(T_ID, "function name")
+
+            if self.current_token.type != T_LPAREN:
+                raise Error("Syntax Error", "Expected '(' after the function spawned")
+
+            return SpawnNode(self.function_call(func_token))
+
+        if token.type == T_AWAIT:
+            self.advance()
+
+            return AwaitNode(self.factor())
+
         # ID (var access)
         if token.type == T_ID:
             var_name = self.current_token
@@ -329,6 +481,12 @@ class Parser:
         # Function Defining 
         if self.current_token.type == T_FUNC:
             return self.function_def()
+
+        if self.current_token.type == T_MEMO:
+            return self.memo_function_def()
+
+        if self.current_token.type in (T_IMPORT, T_FROM):
+            raise Error("Syntax Error", f"'{self.current_token.value}' is only allowed at the top level")
         
         if self.current_token.type == T_VAR:
             self.advance()
@@ -445,6 +603,49 @@ class Parser:
 
         return FunctionDefNode(func_name_token.value, params, body)
     
+    def memo_function_def(self):
+        self.advance()
+
+        memo_size = MEMO_SIZE
+
+        if self.current_token.type == T_LPAREN:
+            self.advance()
+
+            if self.current_token.type != T_INT or self.current_token.value < 1:
+                raise Error("Syntax Error", "Expected cache size after 'memo('")
+
+            memo_size = self.current_token.value
+            self.advance()
+
+            self.expect(T_RPAREN, ")")
+
+        if self.current_token.type != T_FUNC:
+            raise Error("Syntax Error", "Expected 'func' after 'memo'")
+
+        node = self.function_def()
+        node.memo_size = memo_size
+
+        return node
+
+    def import_statement(self):
+        # import module | from module import name, name
+        is_from = self.current_token.type == T_FROM
+        self.advance()
+
+        module = self.expect(T_ID, "module name").value
+
+        if not is_from:
+            return ImportNode(module)
+
+        self.expect(T_IMPORT, "import")
+        names = [self.expect(T_ID, "name").value]
+
+        while self.current_token.type == T_COMMA:
+            self.advance()
+            names.append(self.expect(T_ID, "name").value)
+
+        return ImportNode(module, names)
+
     def function_call(self, func_name_token):
         self.advance()
         args = self.parse_func_args()       
@@ -0,0 +1,181 @@
+import time
+
+from tokens import *
+from interpreter import Interpreter, CACHE_SITES
+import interpreter
+
+# Profiler
+# Deterministic profiler for Pyrite code. ProfilingInterpreter is the tree
+# walking Interpreter with every function call, built in call and loop
+# wrapped in a Profiler entry, so each of them gets a call count, a total
+# time (including everything it called) and a self time (excluding it).
+
+MAIN = "<main>"
+
+OP_TEXT = {
+    T_PLUS: "+", T_MINUS: "-", T_MUL: "*", T_EXP: "^", T_DIV: "/", T_FDIV: "//", T_MOD: "%",
+    T_AVERAGE: "~", T_EQ: "==", T_NEQ: "!=", T_LT: "<", T_LTE: "<=", T_GT: ">", T_GTE: ">=",
+    T_APPROX: "~=", T_AND: "&", T_OR: "|"
+}
+
+def source_text(node):
+    # Short Pyrite-like text of an expression, used to label loops
+    node_type = type(node).__name__
+
+    if node_type == "LiteralNode":
+        return repr(node.token.value) if type(node.token.value) == str else str(node.token.value)
+    if node_type == "VarAccessNode":
+        return node.var_name.value
+    if node_type == "BinOpNode":
+        return f"{source_text(node.left)} {OP_TEXT.get(node.op.type, node.op.type)} {source_text(node.right)}"
+    if node_type == "UnaryOpNode":
+        return f"-{source_text(node.right)}"
+    if node_type == "ListAccessNode":
+        return f"{source_text(node.name)}[{source_text(node.index)}]"
+    if node_type == "FunctionCallNode":
+        return f"{node.name.value}({", ".join(source_text(arg) for arg in node.args)})"
+
+    return "..."
+
+def keep_cache_sites():
+    # Called before running a script whose report is printed at exit
+    interpreter.keep_sites = True
+
+def inline_cache_report(limit = 20):
+    # The busiest operator and index sites of the tree engine and how often
+    # their inline cache held the handler for the operand types
+    sites = sorted(CACHE_SITES, key = lambda node: node.cache.hits + node.cache.misses, reverse = True)
+
+    total = sum(node.cache.hits + node.cache.misses for node in sites) or 1
+    monomorphic = sum(node.cache.hits + node.cache.misses for node in sites if node.cache.state() == "monomorphic")
+
+    lines = [f"{len(sites)} sites, {monomorphic / total * 100:.1f}% of evaluations on monomorphic sites",
+             f"{"runs":>10} {"hit %":>7} {"state":<12} {"types":<24} site"]
+
+    for node in sites[:limit]:
+        cache = node.cache
+        runs = cache.hits + cache.misses
+        types = ", ".join(sorted(f"{left.__name__} {right.__name__}" for left, right in cache.types))
+
+        lines.append(f"{runs:>10} {cache.hits / runs * 100:>6.1f}% {cache.state():<12} {types:<24} {source_text(node)}")
+
+    return "\n".join(lines)
+
+class Entry:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.self_time = 0.0
+
+class Profiler:
+    def __init__(self):
+        self.entries = {}
+        self.stacks = {}
+
+        # Open entries: [name, start time, time spent in children]
+        self.stack = []
+        self.active = {}
+
+        self.enter(MAIN)
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def leave(self):
+        name, start, children = self.stack.pop()
+        elapsed = time.perf_counter() - start
+
+        if name not in self.entries:
+            self.entries[name] = Entry(name)
+
+        entry = self.entries[name]
+        entry.calls += 1
+        entry.self_time += elapsed - children
+
+        # Recursive calls are already inside the outermost call's total
+        self.active[name] -= 1
+        if self.active[name] == 0:
+            entry.total += elapsed
+
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+        path = ";".join([frame[0] for frame in self.stack] + [name])
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - children
+
+    def stop(self):
+        while self.stack:
+            self.leave()
+
+    def report(self, limit = 20):
+        self.stop()
+
+        entries = sorted(self.entries.values(), key = lambda entry: entry.self_time, reverse = True)
+        overall = sum(entry.self_time for entry in entries) or 1.0
+
+        lines = [f"{"calls":>10} {"total ms":>10} {"self ms":>10} {"self %":>7}  name"]
+
+        for entry in entries[:limit]:
+            lines.append(f"{entry.calls:>10} {entry.total * 1e3:>10.2f} {entry.self_time * 1e3:>10.2f} "
+                         f"{entry.self_time / overall * 100:>6.1f}%  {entry.name}")
+
+        return "\n".join(lines)
+
+    def write_collapsed(self, path):
+        # One "frame;frame;frame microseconds" line per stack, the input
+        # format of flamegraph.pl, speedscope and similar tools
+        self.stop()
+
+        with open(path, "w") as file:
+            for stack, seconds in sorted(self.stacks.items()):
+                file.write(f"{stack} {round(seconds * 1e6)}\n")
+
+class ProfilingInterpreter(Interpreter):
+    # Every call gets its own entry, including the ones in tail position
+    tail_calls = False
+
+    def __init__(self):
+        super().__init__()
+        self.profiler = Profiler()
+
+        # Enclosing Pyrite function of each open call, used to label loops
+        self.functions = [MAIN]
+
+    def call(self, node, args):
+        if node.name.type == T_RETURN:
+            return super().call(node, args)
+
+        if node.name.type != T_ID:
+            self.profiler.enter(f"{node.name.value}()")
+
+            try:
+                return super().call(node, args)
+            finally:
+                self.profiler.leave()
+
+        self.profiler.enter(node.name.value)
+        self.functions.append(node.name.value)
+
+        try:
+            return super().call(node, args)
+        finally:
+            self.functions.pop()
+            self.profiler.leave()
+
+    def visit_WhileNode(self, node):
+        self.profiler.enter(f"{self.functions[-1]}: while {source_text(node.condition)}")
+
+        try:
+            return super().visit_WhileNode(node)
+        finally:
+            self.profiler.leave()
+
+    def visit_ForNode(self, node):
+        self.profiler.enter(f"{self.functions[-1]}: for {node.var_name.value} as {source_text(node.condition)}")
+
+        try:
+            return super().visit_ForNode(node)
+        finally:
+            self.profiler.leave()
@@ -0,0 +1,95 @@
+from lexer import Lexer
+from parser import Parser
+from optimizer import Optimizer
+from error import Error
+from run import ENGINES
+import runtime
+import output
+import tasks
+
+# Programs
+# The embedding API: compile(source) lexes, parses, optimizes and prepares a
+# script once, and Program.run executes it as often as needed, each time on
+# a fresh engine with its own globals, imports, tasks, input and captured
+# output. Nothing a run does is kept in the Program, so one Program can be
+# run by many threads at once.
+#
+#   program = compile("var total = a + b\nexec(total)\ntotal")
+#   result = program.run(globals = {"a": 1, "b": 2})
+#   result.value, result.output, result.globals   # 3, "3\n", {"a": 1, ...}
+
+class Result:
+    __slots__ = ("value", "output", "globals")
+
+    def __init__(self, value, output, globals):
+        # Value of the last statement, the text exec() wrote and the
+        # program's globals when it ended
+        self.value = value
+        self.output = output
+        self.globals = globals
+
+    def __repr__(self):
+        return f"Result(value = {self.value!r}, output = {self.output!r})"
+
+class Program:
+    __slots__ = ("source", "engine", "optimize", "path", "prepared")
+
+    def __init__(self, source, engine, optimize, path, prepared):
+        object.__setattr__(self, "source", source)
+        object.__setattr__(self, "engine", engine)
+        object.__setattr__(self, "optimize", optimize)
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "prepared", prepared)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Program objects are immutable")
+
+    def run(self, inputs = None, globals = None):
+        # inputs: values input() returns in order, instead of reading stdin.
+        # globals: name -> value defined before the program starts
+        engine = ENGINES[self.engine]()
+        engine.path = self.path
+
+        # Modules are imported the way the program was compiled
+        engine.modules.optimize = self.optimize
+
+        if globals is not None:
+            for name, value in globals.items():
+                engine.symbol_table.set(name, value)
+
+        previous_inputs = getattr(runtime.program_inputs, "values", None)
+        runtime.program_inputs.values = iter(inputs if inputs is not None else ())
+
+        try:
+            with output.use(output.CaptureSink()) as captured:
+                try:
+                    value = engine.run_prepared(self.prepared)
+                    tasks.finish()
+                except RecursionError:
+                    raise Error("Runtime Error", "Maximum recursion depth exceeded, the vm engine can recurse much deeper") from None
+                finally:
+                    tasks.cancel()
+        finally:
+            runtime.program_inputs.values = previous_inputs
+
+        symbols = engine.symbol_table.symbols
+        names = {name: value for name, value in symbols.items() if not name.startswith("__")}
+
+        return Result(value, captured.getvalue(), names)
+
+    def __repr__(self):
+        return f"<program {self.path or "<string>"} on {self.engine}>"
+
+def compile(source, engine = "tree", optimize = True, path = None):
+    # path: file the source came from, imports are found next to it
+    if engine not in ENGINES:
+        raise Error("Error", f"Unknown engine '{engine}', expected one of: {", ".join(ENGINES)}")
+
+    statements = Parser(Lexer(source).tokenizer()).parse()
+
+    if optimize:
+        statements = list(Optimizer().optimize(statements))
+
+    prepared = ENGINES[engine]().prepare(statements)
+
+    return Program(source, engine, optimize, path, prepared)
@@ -0,0 +1,391 @@
+from tokens import *
+
+# Resolver
+# Runs once after parsing and gives every variable reference a scope depth
+# and a slot index. Depth 0 is the current function's frame, depth 1 the
+# frame of the function it was defined in, and so on. Names that are not
+# declared in any enclosing function resolve to globals (depth None).
+#
+# A frame is a fixed-size list: slot 0 holds the enclosing frame and the
+# remaining slots hold parameters and locals. Functions that declare
+# constants also get one slot holding the set of slots made constant so far.
+#
+# It also marks the returns of each function body that are statements, not
+# parts of a larger expression, so engines can return from them without an
+# exception, and the calls in tail position, whose value is the function's
+# result, so engines can reuse the caller's frame for them.
+#
+# And it marks counted loops, 'for var i = s as i < n do i++' and the like,
+# which the tree and closure engines run as a Python range when s and n turn
+# out to be ints.
+
+def children(node):
+    # Child nodes of a node, not descending into nested function bodies
+    node_type = type(node).__name__
+
+    if node_type == "ListNode":
+        return list(node.elements)
+    if node_type == "ListAccessNode":
+        return [node.name, node.index]
+    if node_type == "BinOpNode":
+        return [node.left, node.right]
+    if node_type == "UnaryOpNode":
+        return [node.right]
+    if node_type in ("VarAssignNode", "ConstAssignNode"):
+        return [node.value]
+    if node_type == "IfNode":
+        nodes = [node.condition] + list(node.body)
+        for cond, body in node.elif_clause:
+            nodes.append(cond)
+            nodes.extend(body)
+        if node.else_body:
+            nodes.extend(node.else_body)
+        return nodes
+    if node_type == "WhileNode":
+        return [node.condition] + list(node.body)
+    if node_type == "ForNode":
+        return [node.init, node.condition, node.update] + list(node.body)
+    if node_type == "FunctionCallNode":
+        return list(node.args)
+    if node_type == "SpawnNode":
+        return [node.call]
+    if node_type == "AwaitNode":
+        return [node.value]
+
+    return []
+
+def const_names(statements):
+    names = set()
+    pending = list(statements)
+
+    while pending:
+        node = pending.pop()
+
+        if type(node).__name__ == "ConstAssignNode":
+            names.add(node.const_name.value)
+
+        pending.extend(children(node))
+
+    return names
+
+# Counted Loops
+# A for loop is counted when its condition compares the loop variable with
+# a bound (<, <= counting up, >, >= counting down), its update steps the
+# variable by a constant (i++, i--, over i = i + k, over i = i - k), and
+# neither the variable nor the bound can change while the body runs. The
+# bound may be any expression of literals, variables and operators, it is
+# evaluated once. A called function could change a global, or a variable
+# of an enclosing function, so loops whose body calls one only count when
+# the variables are the function's own locals and no function nested in it
+# writes them.
+
+def walk(nodes):
+    # Every node under nodes, nested function bodies included
+    pending = list(nodes)
+
+    while pending:
+        node = pending.pop()
+        yield node
+
+        if type(node).__name__ == "FunctionDefNode":
+            pending.extend(node.body)
+
+        pending.extend(children(node))
+
+def written_names(nodes):
+    names = set()
+
+    for node in walk(nodes):
+        node_type = type(node).__name__
+
+        if node_type in ("VarAssignNode", "IncrNode", "DecrNode", "ForNode"):
+            names.add(node.var_name.value)
+        elif node_type == "ConstAssignNode":
+            names.add(node.const_name.value)
+        elif node_type == "FunctionDefNode":
+            names.add(node.name)
+
+    return names
+
+def has_calls(nodes):
+    # Whether nodes can run code that is not in them
+    for node in walk(nodes):
+        node_type = type(node).__name__
+
+        if node_type in ("SpawnNode", "AwaitNode"):
+            return True
+
+        # Other tasks run while input() waits
+        if node_type == "FunctionCallNode" and node.name.type in (T_ID, T_INPUT):
+            return True
+
+    return False
+
+def bound_names(node):
+    # Variables a loop bound reads, None when it is not a pure expression
+    node_type = type(node).__name__
+
+    if node_type == "LiteralNode":
+        return set()
+    if node_type == "VarAccessNode":
+        return {node}
+    if node_type == "UnaryOpNode":
+        return bound_names(node.right)
+    if node_type == "BinOpNode":
+        left = bound_names(node.left)
+        right = bound_names(node.right)
+
+        if left is None or right is None:
+            return None
+
+        return left | right
+
+    return None
+
+def is_loop_var(node, name):
+    return type(node).__name__ == "VarAccessNode" and node.var_name.value == name
+
+def loop_step(node):
+    # The constant a for loop's update adds to its variable, None when it is not one
+    name = node.var_name.value
+    update = node.update
+    update_type = type(update).__name__
+
+    if update_type in ("IncrNode", "DecrNode") and update.var_name.value == name:
+        return 1 if update_type == "IncrNode" else -1
+
+    if update_type != "VarAssignNode" or not update.is_over or update.var_name.value != name:
+        return None
+
+    value = update.value
+
+    if type(value).__name__ != "BinOpNode" or value.op.type not in (T_PLUS, T_MINUS) or not is_loop_var(value.left, name):
+        return None
+
+    if type(value.right).__name__ != "LiteralNode" or type(value.right.token.value) != int or value.right.token.value == 0:
+        return None
+
+    return value.right.token.value if value.op.type == T_PLUS else -value.right.token.value
+
+def loop_shape(node):
+    # (step, comparison) of a loop that counts, None for any other loop
+    condition = node.condition
+
+    if type(condition).__name__ != "BinOpNode" or not is_loop_var(condition.left, node.var_name.value):
+        return None
+
+    step = loop_step(node)
+
+    if step is None:
+        return None
+
+    if step > 0 and condition.op.type in (T_LT, T_LTE):
+        return (step, condition.op.type)
+
+    if step < 0 and condition.op.type in (T_GT, T_GTE):
+        return (step, condition.op.type)
+
+    return None
+
+class Scope:
+    def __init__(self, const_names):
+        self.slots = {}
+        self.nslots = 1
+        self.const_names = const_names
+        self.consts_slot = None
+
+        if const_names:
+            self.consts_slot = self.new_slot()
+
+    def new_slot(self):
+        slot = self.nslots
+        self.nslots += 1
+        return slot
+
+    def declare(self, name):
+        if name not in self.slots:
+            self.slots[name] = self.new_slot()
+
+        return self.slots[name]
+
+class Resolver:
+    def __init__(self):
+        self.scopes = []
+
+        # FunctionDefNodes being resolved, innermost last
+        self.functions = []
+
+    def resolve(self, statements):
+        for node in statements:
+            self.visit(node)
+
+        return statements
+
+    def visit(self, node):
+        method = getattr(self, f"resolve_{type(node).__name__}", None)
+
+        if method is not None:
+            method(node)
+        else:
+            for child in children(node):
+                self.visit(child)
+
+    # Binding Helpers
+
+    def bind(self, node, depth, scope, name):
+        node.depth = depth
+        node.slot = scope.slots[name]
+
+        if hasattr(node, "const_slot") and name in scope.const_names:
+            node.const_slot = scope.consts_slot
+
+    def declare(self, node, name):
+        if not self.scopes:
+            return
+
+        self.scopes[-1].declare(name)
+        self.bind(node, 0, self.scopes[-1], name)
+
+    def lookup(self, node, name):
+        for depth in range(len(self.scopes)):
+            scope = self.scopes[-1 - depth]
+
+            if name in scope.slots:
+                self.bind(node, depth, scope, name)
+                return
+
+    # Resolve Methods
+
+    def resolve_VarAccessNode(self, node):
+        self.lookup(node, node.var_name.value)
+
+    def resolve_VarAssignNode(self, node):
+        self.visit(node.value)
+
+        if node.is_over:
+            self.lookup(node, node.var_name.value)
+        else:
+            self.declare(node, node.var_name.value)
+
+    def resolve_ConstAssignNode(self, node):
+        self.visit(node.value)
+        self.declare(node, node.const_name.value)
+
+    def resolve_IncrNode(self, node):
+        self.lookup(node, node.var_name.value)
+
+    def resolve_DecrNode(self, node):
+        self.lookup(node, node.var_name.value)
+
+    def resolve_ForNode(self, node):
+        self.visit(node.init)
+        self.declare(node, node.var_name.value)
+
+        self.visit(node.condition)
+        for expr in node.body:
+            self.visit(expr)
+        self.visit(node.update)
+
+        node.counted = self.counted(node)
+
+    def resolve_FunctionCallNode(self, node):
+        for arg in node.args:
+            self.visit(arg)
+
+        if node.name.type == T_ID:
+            self.lookup(node, node.name.value)
+
+    def resolve_FunctionDefNode(self, node):
+        # Declared before the body so the function can call itself
+        self.declare(node, node.name)
+
+        scope = Scope(const_names(node.body))
+        node.param_slots = [scope.declare(param.value) for param in node.params]
+
+        self.scopes.append(scope)
+        self.functions.append(node)
+        for expr in node.body:
+            self.visit(expr)
+        self.functions.pop()
+        self.scopes.pop()
+
+        node.nslots = scope.nslots
+        node.consts_slot = scope.consts_slot
+
+        self.mark_block(node.body, True)
+
+    # Counted Loop Helpers
+
+    def counted(self, node):
+        shape = loop_shape(node)
+
+        if shape is None:
+            return None
+
+        reads = bound_names(node.condition.right)
+
+        if reads is None:
+            return None
+
+        names = {read.var_name.value for read in reads}
+
+        # The bound is only evaluated once, it cannot follow the variable
+        if node.var_name.value in names:
+            return None
+
+        names.add(node.var_name.value)
+
+        if names & written_names(node.body):
+            return None
+
+        if not has_calls(node.body):
+            return shape
+
+        # Only the function's own locals are out of reach of the functions called
+        if not self.functions or any(read.depth != 0 for read in reads) or node.depth != 0:
+            return None
+
+        nested = [child for child in walk(self.functions[-1].body) if type(child).__name__ == "FunctionDefNode"]
+
+        for function in nested:
+            if names & written_names(function.body):
+                return None
+
+        return shape
+
+    # Return Position Helpers
+
+    def mark_block(self, nodes, is_tail):
+        for i in range(len(nodes)):
+            self.mark_statement(nodes[i], is_tail and i == len(nodes) - 1)
+
+    def mark_statement(self, node, is_tail):
+        node_type = type(node).__name__
+
+        if node_type == "FunctionCallNode":
+            if node.name.type == T_RETURN:
+                node.is_statement = True
+
+                # With more arguments the others are still evaluated after the first
+                if len(node.args) == 1:
+                    self.mark_tail(node.args[0])
+
+            elif is_tail:
+                self.mark_tail(node)
+
+        elif node_type == "IfNode":
+            self.mark_block(node.body, is_tail)
+
+            for cond, body in node.elif_clause:
+                self.mark_block(body, is_tail)
+
+            if node.else_body:
+                self.mark_block(node.else_body, is_tail)
+
+        # A loop's body is never in tail position, the loop continues after it
+        elif node_type in ("WhileNode", "ForNode"):
+            self.mark_block(node.body, False)
+
+    def mark_tail(self, node):
+        if type(node).__name__ == "FunctionCallNode" and node.name.type == T_ID:
+            node.is_tail = True
@@ -1,31 +1,104 @@
 import os
+import sys
+import argparse
 
-from lexer import Lexer
+from lexer import Lexer, open_source
 from parser import Parser
 from interpreter import Interpreter
+from closures import ClosureInterpreter
+from vm import VM
+from transpiler import TranspiledInterpreter
+from optimizer import Optimizer
+from profiler import ProfilingInterpreter, inline_cache_report, keep_cache_sites
 from error import Error
+import cache
+import modules
+import parallel
+import tasks
+import output
+
+ENGINES = {
+    "tree": Interpreter,
+    "closure": ClosureInterpreter,
+    "vm": VM,
+    "python": TranspiledInterpreter
+}
 
 interpreter = Interpreter()
+use_cache = True
+use_optimizer = True
 
-def run(text):
+def set_engine(name):
+    global interpreter
 
-    try:
-        lexer = Lexer(text)
+    if name not in ENGINES:
+        return Error("Error", f"Unknown engine '{name}', expected one of: {", ".join(ENGINES)}")
+
+    interpreter = ENGINES[name]()
+    return None
+
+def parse(text, stream = False):
+    lexer = Lexer(text)
+
+    # Streaming runs each top level statement as soon as it is parsed,
+    # keeping only the current statement's tokens and nodes in memory
+    if stream:
+        ast = lexer.located(Parser(lexer.stream()).parse_stream())
+    else:
         tokens = lexer.tokenizer()
 
         parser = Parser(tokens)
         ast = parser.parse()
 
+    if use_optimizer:
+        return Optimizer().optimize(ast)
+
+    return ast
+
+def parse_cached(path, text):
+    # Statements from the compiled cache, or streamed from the source and
+    # saved to the cache once the whole script has been parsed
+    statements = cache.load(path, text, use_optimizer)
+
+    if statements is not None:
+        yield from statements
+        return
+
+    parsed = []
+    for stmt in parse(text, stream = True):
+        parsed.append(stmt)
+        yield stmt
+
+    cache.save(path, text, parsed, use_optimizer)
+
+def run(text, stream = False, path = None):
+    # Imports are found next to the script, or in the working directory from the REPL
+    interpreter.path = path
+    modules.use_optimizer = use_optimizer
+
+    try:
+        if path is not None and use_cache:
+            ast = parse_cached(path, text)
+        else:
+            ast = parse(text, stream)
+
         result = None
         for stmt in ast:
             result = interpreter.visit(stmt)
+
+        tasks.finish()
         
         return format_result(result)
     
     except Error as e:
         return e
+    except RecursionError:
+        return Error("Runtime Error", "Maximum recursion depth exceeded, the vm engine can recurse much deeper")
     except Exception as e:
-        return f"Unhandled Error: {e}"
+        return Error("Unhandled Error", str(e))
+    finally:
+        tasks.cancel()
+        output.flush()
 
 def run_file(path):
     if not path.endswith(".pyr"):
@@ -35,10 +108,8 @@ def run_file(path):
         return f"Error: File '{path}' not found"
     
     try:
-        with open(path, 'r') as file:
-            code = file.read()
-
-        print(run(code))
+        with open_source(path) as code:
+            print(run(code, stream = True, path = path))
 
     except Exception as e:
         return f"Error: Failed to read file '{path}'. {str(e)}"
@@ -53,12 +124,24 @@ def format_result(value):
     return value
     
 def repl():
+    global use_optimizer
+
+    # Every line shows up as soon as it is written, unless --output sent it to a file
+    if type(output.sink) is output.StreamSink:
+        output.set_sink(output.StreamSink(buffer_size = 0))
+
     while True:
         try:
             cmd = input("> ")
 
             if cmd.startswith("run "):
                 run_file(cmd[4:].strip())
+            elif cmd.startswith("engine "):
+                error = set_engine(cmd[7:].strip())
+                if error is not None:
+                    print(error)
+            elif cmd.startswith("optimize "):
+                use_optimizer = cmd[9:].strip() != "off"
             elif cmd.strip() != "":
                 result = run(cmd)
                 if result is not None:
@@ -69,4 +152,57 @@ def repl():
             break
 
 if __name__ == "__main__":
-    repl()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description = "Run Pyrite code")
+    arg_parser.add_argument("file", nargs = "?", help = "a .pyr script to run instead of starting the REPL")
+    arg_parser.add_argument("--engine", choices = list(ENGINES), default = "tree", help = "execution engine")
+    arg_parser.add_argument("--max-depth", type = int, default = VM.max_depth, help = "deepest Pyrite recursion the vm engine allows")
+    arg_parser.add_argument("--no-optimize", action = "store_true", help = "run the program without the optimizer pass")
+    arg_parser.add_argument("--profile", action = "store_true", help = "run on a profiling tree engine and print the hot spots at exit")
+    arg_parser.add_argument("--profile-stacks", metavar = "FILE", help = "also write collapsed stacks for flamegraph tools to FILE")
+    arg_parser.add_argument("--cache-stats", action = "store_true", help = "print how well the tree engine's inline caches matched operand types at exit")
+    arg_parser.add_argument("--workers", type = int, default = parallel.workers, help = "worker processes for pmap, pfilter and preduce, 0 to run them in this process")
+    arg_parser.add_argument("--yield-every", type = int, default = tasks.yield_every, help = "loop iterations a spawned task runs before the others get a turn, 0 for never")
+    arg_parser.add_argument("--output", metavar = "FILE", help = "write exec() output to FILE instead of stdout")
+    arg_parser.add_argument("--buffer-size", type = int, default = output.sink.buffer_size, help = "characters of exec() output buffered before writing, 0 writes every line")
+    arg_parser.add_argument("--no-cache", action = "store_true", help = "don't read or write the __pyrcache__ compiled cache")
+    args = arg_parser.parse_args()
+
+    VM.max_depth = args.max_depth
+    parallel.workers = args.workers
+    tasks.yield_every = args.yield_every
+
+    if args.output:
+        output.set_sink(output.FileSink(args.output, max(args.buffer_size, 1)))
+    elif sys.stdout.isatty():
+        # Long scripts still show progress in a terminal
+        output.set_sink(output.StreamSink(buffer_size = args.buffer_size, interval = 0.1))
+    else:
+        output.set_sink(output.StreamSink(buffer_size = args.buffer_size))
+
+    set_engine(args.engine)
+    use_cache = not args.no_cache
+    use_optimizer = not args.no_optimize
+
+    if args.cache_stats:
+        keep_cache_sites()
+
+    profiling = args.profile or args.profile_stacks is not None
+    if profiling:
+        interpreter = ProfilingInterpreter()
+
+    try:
+        if args.file:
+            error = run_file(args.file)
+            if error is not None:
+                print(error)
+        else:
+            repl()
+    finally:
+        if profiling:
+            print(interpreter.profiler.report())
+
+            if args.profile_stacks:
+                interpreter.profiler.write_collapsed(args.profile_stacks)
+
+        if args.cache_stats:
+            print(inline_cache_report())
\ No newline at end of file
@@ -0,0 +1,567 @@
+import bisect
+import operator
+import itertools
+import threading
+from collections import OrderedDict
+
+from tokens import *
+from error import Error
+from arrays import Array, reduce_sum, reduce_min, reduce_max, reduce_mean
+import parallel
+import tasks
+import output
+
+# Shared operator, frame and built in function implementations used by the engines
+
+# An Array compared with 0 gives another Array, it checks its own divisors
+
+def op_div(left, right):
+    if type(right) != Array and right == 0:
+        raise Error("Zero Division Error", "Cannot divide by 0")
+    return left / right
+
+def op_fdiv(left, right):
+    if type(right) != Array and right == 0:
+        raise Error("Zero Division Error", "Cannot divide by 0")
+    return left // right
+
+def op_mod(left, right):
+    if type(right) != Array and right == 0:
+        raise Error("Zero Division Error", "Cannot divide by 0")
+    return left % right
+
+# Frames
+
+class Unset:
+    def __repr__(self):
+        return "<unset>"
+
+    def __reduce__(self):
+        # Unpickled as the one UNSET, slots are checked with 'is'
+        return "UNSET"
+
+# Value of a frame slot whose variable has not been assigned yet
+UNSET = Unset()
+
+def outer_frame(frame, depth):
+    for _ in range(depth):
+        frame = frame[0]
+
+    return frame
+
+# Memoization
+# A 'memo func' caches its results in a Memo, keyed on its argument values.
+# Lists are keyed by their contents (Pyrite lists are never changed in
+# place) and every value by its type too, so f(1) and f(1.0) stay apart.
+
+# Results a 'memo func' keeps when no size is given
+MEMO_SIZE = 4096
+
+def memo_key(values):
+    key = []
+
+    for value in values:
+        if type(value) == list:
+            key.append((list, memo_key(value)))
+        elif type(value) == Array:
+            key.append((Array, value.values.typecode, tuple(value.values)))
+        else:
+            key.append((type(value), value))
+
+    return tuple(key)
+
+class Memo:
+    def __init__(self, size = MEMO_SIZE):
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, func, args):
+        # Extra arguments are ignored by the call, so they are not part of the key
+        return memo_key(args[:len(func.params)])
+
+    def get(self, key):
+        # The cached result, or UNSET (counted as a miss) when there is none
+        result = self.results.get(key, UNSET)
+
+        if result is UNSET:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(key)
+
+        return result
+
+    def put(self, key, result):
+        self.results[key] = result
+
+        # Least recently used results go first
+        if len(self.results) > self.size:
+            self.results.popitem(last = False)
+
+class Function:
+    def __init__(self, name, params, body, closure = None, nslots = 1, param_slots = None, consts_slot = None, memo_size = None, globals = None, node = None):
+        self.name = name
+        self.params = params
+        self.body = body
+        self.closure = closure
+        self.nslots = nslots
+        self.param_slots = param_slots or []
+        self.consts_slot = consts_slot
+
+        # SymbolTable of the module the function was defined in, for engines
+        # that look global names up through the engine running the call
+        self.globals = globals
+
+        # FunctionDefNode the function was defined by, used to send it to pmap workers
+        self.node = node
+
+        # Every definition of a 'memo func' gets its own cache
+        self.memo = None
+        if memo_size is not None:
+            self.memo = Memo(memo_size)
+
+    @classmethod
+    def from_node(cls, node, body, closure = None, globals = None):
+        params = [param.value for param in node.params]
+
+        return cls(node.name, params, body, closure, node.nslots, node.param_slots, node.consts_slot, node.memo_size, globals, node)
+
+    def __reduce__(self):
+        # Pickled as a tree engine function of the same definition, see parallel.py
+        if self.node is None:
+            raise Error("Runtime Error", f"'{self.name}' has no definition to send to worker processes")
+
+        if self.node.depth is not None and self.closure is None:
+            raise Error("Runtime Error", f"'{self.name}' uses variables of an enclosing function and cannot be sent to worker processes on this engine")
+
+        return (rebuild_function, (self.node,), (self.closure, self.globals))
+
+    def __setstate__(self, state):
+        self.closure, self.globals = state
+
+    def new_frame(self, args):
+        if len(args) < len(self.param_slots):
+            raise Error("Runtime Error", f"'{self.name}' expects {len(self.param_slots)} arguments, got {len(args)}")
+
+        frame = [UNSET] * self.nslots
+        frame[0] = self.closure
+
+        for i in range(len(self.param_slots)):
+            frame[self.param_slots[i]] = args[i]
+
+        if self.consts_slot is not None:
+            frame[self.consts_slot] = set()
+
+        return frame
+
+    def __repr__(self):
+        if self.memo is not None:
+            return f"<memo func {self.name} ({self.memo.hits} hits, {self.memo.misses} misses)>"
+
+        return f"<func {self.name}>"
+
+def rebuild_function(node):
+    return Function.from_node(node, node.body)
+
+# Returns without exceptions
+# A return statement evaluates to a Return, which the blocks around it hand
+# straight up to the function call. A call in tail position evaluates to a
+# TailCall instead of running, and the call that is waiting for the result
+# runs it in a loop, so tail recursion needs no extra Python stack.
+
+class Return:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+class TailCall:
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+BINARY_OPS = {
+    T_PLUS: lambda left, right: left + right,
+    T_MINUS: lambda left, right: left - right,
+    T_MUL: lambda left, right: left * right,
+    T_EXP: lambda left, right: left ** right,
+    T_DIV: op_div,
+    T_FDIV: op_fdiv,
+    T_MOD: op_mod,
+    T_AVERAGE: lambda left, right: (left + right) / 2,
+    T_EQ: lambda left, right: left == right,
+    T_NEQ: lambda left, right: left != right,
+    T_LT: lambda left, right: left < right,
+    T_LTE: lambda left, right: left <= right,
+    T_GT: lambda left, right: left > right,
+    T_GTE: lambda left, right: left >= right,
+    T_APPROX: lambda left, right: abs(left - right) <= 0.01,
+    T_AND: lambda left, right: left and right,
+    T_OR: lambda left, right: left or right
+}
+
+def counted_range(counted, start, bound):
+    # The values of a counted loop's variable (see resolver.py), one per run of its body
+    step, comparison = counted
+
+    if comparison == T_LTE:
+        bound += 1
+    elif comparison == T_GTE:
+        bound -= 1
+
+    return range(start, bound, step)
+
+def list_access(list_val, index):
+    if type(list_val) != list and type(list_val) != Array:
+        raise Error("Runtime Error", "Expected list")
+
+    if type(index) != int:
+        raise Error("Runtime Error", "Expected index as int")
+
+    try:
+        return list_val[index]
+    except IndexError:
+        raise Error("Runtime Error", "List index out of range")
+
+# Inline Caches
+# Every BinOpNode and ListAccessNode the tree engine runs gets an
+# InlineCache (sharing EMPTY_CACHE until then): the operand types the site
+# saw last and a handler specialized for them, such as operator.add for
+# int + int. While the types match, the site calls the handler directly.
+# When they change it is specialized again for the new ones, and once it has
+# seen more than MAX_SPECIALIZATIONS type pairs it is megamorphic and stays
+# on the generic BINARY_OPS path.
+
+MAX_SPECIALIZATIONS = 4
+
+# Op of a ListAccessNode site
+INDEX = "INDEX"
+
+# Number operators whose Python operator already behaves like Pyrite's,
+# division and modulo keep their zero checks
+NUMBER_OPS = {
+    T_PLUS: operator.add,
+    T_MINUS: operator.sub,
+    T_MUL: operator.mul,
+    T_EQ: operator.eq,
+    T_NEQ: operator.ne,
+    T_LT: operator.lt,
+    T_LTE: operator.le,
+    T_GT: operator.gt,
+    T_GTE: operator.ge
+}
+
+SEQUENCE_OPS = {
+    T_PLUS: operator.add,
+    T_EQ: operator.eq,
+    T_NEQ: operator.ne
+}
+
+def index_list(list_val, index):
+    # list_access once the types are known to be a list (or Array) and an int
+    try:
+        return list_val[index]
+    except IndexError:
+        raise Error("Runtime Error", "List index out of range")
+
+def specialize(op, left_type, right_type):
+    if op == INDEX:
+        if (left_type == list or left_type == Array) and right_type == int:
+            return index_list
+
+        return list_access
+
+    handler = None
+
+    if (left_type == int or left_type == float) and (right_type == int or right_type == float):
+        handler = NUMBER_OPS.get(op)
+    elif left_type == right_type and (left_type == str or left_type == list):
+        handler = SEQUENCE_OPS.get(op)
+
+    if handler is None:
+        if op not in BINARY_OPS:
+            raise Error("Runtime Error", f"Unsupported operator '{op}'")
+
+        handler = BINARY_OPS[op]
+
+    return handler
+
+UNCACHED = (None, None, None)
+
+class InlineCache:
+    __slots__ = ("entry", "hits", "misses", "types")
+
+    def __init__(self):
+        # (left type, right type, handler), replaced as a whole so threads
+        # running the same nodes never see the guard of one and the handler
+        # of another. None never matches a type
+        self.entry = UNCACHED
+
+        self.hits = 0
+        self.misses = 0
+
+        # Every (left type, right type) pair the site has seen
+        self.types = ()
+
+    def __reduce__(self):
+        # Handlers cannot all be pickled, a pickled node's cache starts over
+        # on the shared EMPTY_CACHE, whether or not it had run
+        return (empty_cache, ())
+
+    def update(self, op, left, right):
+        # The handler for operands that failed the guard, specializing the site for them
+        self.misses += 1
+
+        pair = (type(left), type(right))
+
+        if pair not in self.types:
+            self.types += (pair,)
+
+        handler = specialize(op, pair[0], pair[1])
+
+        if len(self.types) > MAX_SPECIALIZATIONS:
+            self.entry = UNCACHED
+        else:
+            self.entry = (pair[0], pair[1], handler)
+
+        return handler
+
+    def state(self):
+        if len(self.types) <= 1:
+            return "monomorphic"
+
+        if len(self.types) <= MAX_SPECIALIZATIONS:
+            return "polymorphic"
+
+        return "megamorphic"
+
+# Cache of every node until the tree engine first runs it, its guard never matches
+EMPTY_CACHE = InlineCache()
+
+def empty_cache():
+    return EMPTY_CACHE
+
+# Built In Functions
+
+def builtin_exec(args):
+    output.print_line("\n".join(map(str, args)))
+    return None
+
+def input_prompt(args):
+    if args:
+        return "> " + str(args[0])
+
+    return "> "
+
+def input_value(user):
+    # Text typed by the user, values given to a program are used as they are
+    if type(user) != str:
+        return user
+
+    if user.isdigit():
+        return int(user)
+    try:
+        return float(user)
+    except ValueError:
+        return user
+
+# Values input() answers with on this thread while a Program runs, see program.py
+program_inputs = threading.local()
+
+def next_input():
+    value = next(program_inputs.values, UNSET)
+
+    if value is UNSET:
+        raise Error("Runtime Error", "input() was called more times than the program was given inputs")
+
+    return value
+
+def builtin_input(args):
+    if getattr(program_inputs, "values", None) is not None:
+        return input_value(next_input())
+
+    # The prompt has to come after everything exec wrote before it
+    output.flush()
+
+    # Tasks keep running while the program waits for its line
+    if tasks.has_pending():
+        return input_value(tasks.read_line(input_prompt(args)))
+
+    return input_value(input(input_prompt(args)))
+
+# List Functions
+# Bulk operations that run as one native call instead of an interpreted
+# loop. They never change their argument: sort, reverse, slice and concat
+# return a new value of the same kind (list, string or Array).
+
+def expect_sequence(name, value):
+    if type(value) not in (list, str, Array):
+        raise Error("Runtime Error", f"{name}() expects a list, string or array")
+
+def expect_int(name, value):
+    if type(value) != int:
+        raise Error("Runtime Error", f"{name}() expects int arguments")
+
+def builtin_range(args):
+    for arg in args:
+        expect_int("range", arg)
+
+    if len(args) == 3 and args[2] == 0:
+        raise Error("Runtime Error", "range() step cannot be 0")
+
+    return list(range(*args))
+
+def builtin_sort(args):
+    values = args[0]
+    expect_sequence("sort", values)
+
+    try:
+        result = sorted(values)
+    except TypeError:
+        raise Error("Runtime Error", "sort() cannot compare values of different types") from None
+
+    if type(values) == str:
+        return "".join(result)
+    if type(values) == Array:
+        return Array(result)
+
+    return result
+
+def builtin_reverse(args):
+    values = args[0]
+    expect_sequence("reverse", values)
+
+    if type(values) == Array:
+        return Array(reversed(values.values))
+
+    return values[::-1]
+
+def builtin_slice(args):
+    values = args[0]
+    expect_sequence("slice", values)
+
+    # slice(xs, start) runs to the end, negative positions count from it
+    for arg in args[1:3]:
+        expect_int("slice", arg)
+
+    start = args[1] if len(args) > 1 else None
+    end = args[2] if len(args) > 2 else None
+
+    if type(values) == Array:
+        return Array(values.values[start:end])
+
+    return values[start:end]
+
+def builtin_concat(args):
+    if not args:
+        return []
+
+    kind = type(args[0])
+    expect_sequence("concat", args[0])
+
+    if any(type(arg) != kind for arg in args):
+        raise Error("Runtime Error", "concat() expects values of the same type")
+
+    if kind == str:
+        return "".join(args)
+    if kind == Array:
+        return Array(itertools.chain.from_iterable(args))
+
+    return list(itertools.chain.from_iterable(args))
+
+def builtin_bisect(args):
+    # Where the value would go in the sorted sequence, before any equal values
+    values = args[0]
+    expect_sequence("bisect", values)
+
+    try:
+        return bisect.bisect_left(values, args[1])
+    except TypeError:
+        raise Error("Runtime Error", "bisect() cannot compare values of different types") from None
+
+def builtin_search(args):
+    # Binary search of a sorted sequence, the index of the value or -1
+    values = args[0]
+    position = builtin_bisect(args)
+
+    if position < len(values) and values[position] == args[1]:
+        return position
+
+    return -1
+
+def builtin_index(args):
+    # Linear search, the index of the first match or -1
+    values = args[0]
+    expect_sequence("index", values)
+
+    if type(values) == str:
+        return values.find(str(args[1]))
+    if type(values) == Array:
+        values = values.values
+
+    try:
+        return values.index(args[1])
+    except ValueError:
+        return -1
+
+# Parallel Functions
+
+def expect_parallel(name, args, count):
+    if len(args) < count:
+        raise Error("Runtime Error", f"{name}() expects {count} arguments, got {len(args)}")
+
+    if type(args[0]) != Function:
+        raise Error("Runtime Error", f"{name}() expects a function")
+
+    if type(args[1]) != list and type(args[1]) != Array:
+        raise Error("Runtime Error", f"{name}() expects a list or array")
+
+    return args[0], list(args[1])
+
+def builtin_pmap(args):
+    return parallel.pmap(*expect_parallel("pmap", args, 2))
+
+def builtin_pfilter(args):
+    return parallel.pfilter(*expect_parallel("pfilter", args, 2))
+
+def builtin_preduce(args):
+    # preduce(func, list, initial), the initial value goes first
+    func, values = expect_parallel("preduce", args, 2)
+
+    if len(args) > 2:
+        values.insert(0, args[2])
+
+    return parallel.preduce(func, values)
+
+BUILTINS = {
+    T_EXEC: builtin_exec,
+    T_INPUT: builtin_input,
+    T_LEN: lambda args: len(args[0]),
+    T_TYPE: lambda args: str(type(args[0]).__name__),
+    T_STRCON: lambda args: str(args[0]),
+    T_INTCON: lambda args: int(args[0]),
+    T_FLOATCON: lambda args: float(args[0]),
+    T_BOOLCON: lambda args: bool(args[0]),
+    T_ABS: lambda args: abs(args[0]),
+    T_POW: lambda args: args[0] ** args[1],
+    T_ARRAY: lambda args: Array(args[0]),
+    T_SUM: lambda args: reduce_sum(args[0]),
+    T_MIN: lambda args: reduce_min(args[0]),
+    T_MAX: lambda args: reduce_max(args[0]),
+    T_MEAN: lambda args: reduce_mean(args[0]),
+    T_RANGE: builtin_range,
+    T_SORT: builtin_sort,
+    T_REVERSE: builtin_reverse,
+    T_SLICE: builtin_slice,
+    T_CONCAT: builtin_concat,
+    T_BISECT: builtin_bisect,
+    T_SEARCH: builtin_search,
+    T_INDEX: builtin_index,
+    T_PMAP: builtin_pmap,
+    T_PFILTER: builtin_pfilter,
+    T_PREDUCE: builtin_preduce
+}
@@ -0,0 +1,163 @@
+import sys
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from error import Error
+import output
+
+# Tasks
+# 'spawn f(x)' starts f(x) as a task and gives back a task value, 'await
+# task' waits for its result. Tasks are cooperative: they take turns on one
+# asyncio event loop and only switch at 'await', at 'input' (which waits for
+# its line without holding up the other tasks) and every yield_every loop
+# iterations. The program itself is not a task, it runs the loop while it
+# awaits or waits for input, and finishes the tasks left when it ends.
+#
+# Tasks always run on the VM, the only engine that keeps its calls on a
+# frame list it can put aside in the middle: functions defined on another
+# engine are compiled to bytecode from their definitions when spawned.
+#
+# Every thread has its own event loop and tasks, so programs run by several
+# threads at once (see program.py) never share them.
+
+# Loop iterations a task runs before letting the others have a turn, 0 never switches
+yield_every = 1000
+
+# The current thread's loop, its tasks and the lock queuing them for input
+state = threading.local()
+
+# input() is read by one helper thread, queued lines go to the tasks in order
+reader = None
+reader_lock = threading.Lock()
+
+class Task:
+    def __init__(self, name, future):
+        self.name = name
+        self.future = future
+
+    def __repr__(self):
+        if self.future.done():
+            return f"<task {self.name} done>"
+
+        return f"<task {self.name}>"
+
+class Input:
+    # Yielded by a task to wait for a line of input
+    def __init__(self, prompt):
+        self.prompt = prompt
+
+def get_loop():
+    if getattr(state, "loop", None) is None:
+        state.loop = asyncio.new_event_loop()
+        state.pending = []
+        state.input_lock = asyncio.Lock()
+
+    return state.loop
+
+def get_pending():
+    return getattr(state, "pending", [])
+
+def has_pending():
+    return any(not task.future.done() for task in get_pending())
+
+async def drive(steps):
+    # Runs a VM task generator, serving what it yields: None for a turn,
+    # a Task to await or an Input request
+    value = None
+
+    while True:
+        try:
+            request = steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+
+        value = None
+
+        if request is None:
+            await asyncio.sleep(0)
+        elif type(request) == Task:
+            value = await request.future
+        else:
+            value = await next_line(request.prompt)
+
+async def next_line(prompt):
+    global reader
+
+    # Imported here, runtime imports this module
+    from runtime import program_inputs, next_input
+
+    # A program given its inputs answers from them
+    if getattr(program_inputs, "values", None) is not None:
+        return next_input()
+
+    with reader_lock:
+        if reader is None:
+            reader = ThreadPoolExecutor(max_workers = 1)
+
+    async with state.input_lock:
+        output.flush()
+        print(prompt, end = "", flush = True)
+        line = await get_loop().run_in_executor(reader, sys.stdin.readline)
+
+    # Like input() at the end of the input
+    if line == "":
+        raise EOFError()
+
+    return line.rstrip("\n")
+
+def spawn(func, args, name):
+    # Imported here, the VM imports runtime, which imports this module
+    from vm import VM
+    from runtime import UNSET, Function
+
+    if func is UNSET:
+        raise Error("Runtime Error", f"'{name}' not defined")
+
+    if type(func) != Function:
+        raise Error("Runtime Error", f"'{name}' is not a function")
+
+    task = Task(func.name, get_loop().create_task(drive(VM().run_task(func, args))))
+    state.pending.append(task)
+
+    return task
+
+def wait(value):
+    # await outside of a task, runs the loop until the task is done
+    if type(value) != Task:
+        raise Error("Runtime Error", "await expects a task")
+
+    return get_loop().run_until_complete(value.future)
+
+def read_line(prompt):
+    # input() outside of a task, the tasks keep running while it waits
+    return get_loop().run_until_complete(next_line(prompt))
+
+def take_pending():
+    futures = [task.future for task in get_pending()]
+    state.pending = []
+
+    return futures
+
+def finish():
+    # Runs the tasks still pending when the program ends, raising the first error
+    futures = take_pending()
+
+    if not futures:
+        return
+
+    results = get_loop().run_until_complete(asyncio.gather(*futures, return_exceptions = True))
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+def cancel():
+    # Drops the tasks an error left behind
+    futures = take_pending()
+
+    for future in futures:
+        future.cancel()
+
+    if futures:
+        get_loop().run_until_complete(asyncio.gather(*futures, return_exceptions = True))
@@ -0,0 +1,66 @@
+import os
+import pickle
+import tempfile
+
+from lexer import Lexer
+from parser import Parser
+from interpreter import Interpreter
+from runtime import EMPTY_CACHE
+import cache
+import parallel
+
+# Statements and functions the tree engine has run carry specialized inline
+# caches, they must still pickle for the compiled cache and pmap
+
+SOURCE = """var xs = [1, 2, 3]
+func f(x) { return(x * x + xs[0]) }
+f(2)
+"""
+
+def run_tree(source):
+    engine = Interpreter()
+    statements = Parser(Lexer(source).tokenizer()).parse()
+
+    for stmt in statements:
+        engine.visit(stmt)
+
+    return engine, statements
+
+def test_run_statements_round_trip_through_cache():
+    _, statements = run_tree(SOURCE)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "script.pyr")
+
+        with open(path, "w") as file:
+            file.write(SOURCE)
+
+        cache.save(path, SOURCE, statements)
+        loaded = cache.load(path, SOURCE)
+
+    assert loaded is not None
+
+    engine = Interpreter()
+    for stmt in loaded:
+        result = engine.visit(stmt)
+
+    assert result == 5
+
+def test_unpickled_nodes_share_the_empty_cache():
+    _, statements = run_tree(SOURCE)
+    # return(x * x + xs[0])
+    body = pickle.loads(pickle.dumps(statements))[1].body[0]
+
+    assert body.args[0].cache is EMPTY_CACHE
+
+def test_pmap_of_a_function_that_has_run():
+    engine, _ = run_tree(SOURCE)
+    func = engine.symbol_table.get("f")
+
+    previous = parallel.workers
+    parallel.workers = 0
+
+    try:
+        assert parallel.pmap(func, [1, 2, 3]) == [2, 5, 10]
+    finally:
+        parallel.workers = previous
@@ -79,6 +79,11 @@ T_DO = "DO"
 
 # Functions
 T_FUNC = "FUNC"
+T_MEMO = "MEMO"
+
+# Tasks
+T_SPAWN = "SPAWN"
+T_AWAIT = "AWAIT"
 
 # Built in Functions
 T_EXEC = "EXEC"
@@ -92,6 +97,22 @@ T_FLOATCON = "FLOATCON"
 T_BOOLCON = "BOOLCON"
 T_ABS = "ABS"
 T_POW = "POW"
+T_ARRAY = "ARRAY"
+T_SUM = "SUM"
+T_MIN = "MIN"
+T_MAX = "MAX"
+T_MEAN = "MEAN"
+T_RANGE = "RANGE"
+T_SORT = "SORT"
+T_REVERSE = "REVERSE"
+T_SLICE = "SLICE"
+T_CONCAT = "CONCAT"
+T_BISECT = "BISECT"
+T_SEARCH = "SEARCH"
+T_INDEX = "INDEX"
+T_PMAP = "PMAP"
+T_PFILTER = "PFILTER"
+T_PREDUCE = "PREDUCE"
 
 # Comment
 T_COMMENT = "COMMENT" 
@@ -112,6 +133,9 @@ KEYWORDS = {
     "as": T_AS,
     "do": T_DO,
     "func": T_FUNC,
+    "memo": T_MEMO,
+    "spawn": T_SPAWN,
+    "await": T_AWAIT,
     "import": T_IMPORT,
     "from": T_FROM
 }
@@ -127,5 +151,21 @@ BUILTIN = {
     "flt": T_FLOATCON,
     "bool": T_BOOLCON,
     "abs": T_ABS,
-    "pow": T_POW
+    "pow": T_POW,
+    "array": T_ARRAY,
+    "sum": T_SUM,
+    "min": T_MIN,
+    "max": T_MAX,
+    "mean": T_MEAN,
+    "range": T_RANGE,
+    "sort": T_SORT,
+    "reverse": T_REVERSE,
+    "slice": T_SLICE,
+    "concat": T_CONCAT,
+    "bisect": T_BISECT,
+    "search": T_SEARCH,
+    "index": T_INDEX,
+    "pmap": T_PMAP,
+    "pfilter": T_PFILTER,
+    "preduce": T_PREDUCE
 }
\ No newline at end of file
@@ -0,0 +1,685 @@
+import re
+import keyword
+
+from tokens import *
+from error import Error
+from parser import IncrNode, DecrNode, LiteralNode
+from interpreter import SymbolTable, ReturnSignal
+from runtime import UNSET, Function, BUILTINS, list_access, op_div, op_fdiv, op_mod
+from modules import Modules, import_module
+import tasks
+import output
+
+# Transpiler
+# Translates Pyrite statements into Python source. Pyrite globals become
+# globals of the generated code, so the symbol table dict doubles as the
+# globals dict it runs in. Each Pyrite function becomes a Python def whose
+# locals are named _<function id>_<name>, so the resolver's slots map onto
+# Python's fast locals and closure cells. Generated helper names all start
+# with "_", which Pyrite identifiers never do.
+
+LOCAL_NAME = re.compile(r"^_\d+_")
+
+INLINE_OPS = {
+    T_PLUS: "+",
+    T_MINUS: "-",
+    T_MUL: "*",
+    T_EXP: "**",
+    T_EQ: "==",
+    T_NEQ: "!=",
+    T_LT: "<",
+    T_LTE: "<=",
+    T_GT: ">",
+    T_GTE: ">="
+}
+
+HELPER_OPS = {
+    T_DIV: "_div",
+    T_FDIV: "_fdiv",
+    T_MOD: "_mod",
+    T_AND: "_and",
+    T_OR: "_or"
+}
+
+# Built in functions with a direct Python equivalent when called with one argument
+INLINE_BUILTINS = {
+    T_LEN: "_len",
+    T_TYPE: "_typename",
+    T_STRCON: "_str",
+    T_INTCON: "_int",
+    T_FLOATCON: "_float",
+    T_BOOLCON: "_bool",
+    T_ABS: "_abs"
+}
+
+class Context:
+    def __init__(self, fid, is_pyrite):
+        self.fid = fid
+        self.is_pyrite = is_pyrite
+        self.globals = set()
+        self.nonlocals = set()
+
+        # Own locals assigned by nested functions
+        self.captured = set()
+
+class Transpiler:
+    def __init__(self, nodes = None):
+        # FunctionDefNodes the generated code refers to as _N[index]
+        self.nodes = nodes if nodes is not None else []
+
+        self.lines = []
+        self.indent = 0
+        self.counter = 0
+        self.temps = set()
+
+        # One context per generated def, the innermost last
+        self.contexts = []
+
+    def transpile(self, statements, name = "_main"):
+        self.function(name, statements)
+
+        return "\n".join(self.lines) + "\n"
+
+    # Emit Helpers
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def temp(self):
+        self.counter += 1
+        temp = f"_t{self.counter}"
+        self.temps.add(temp)
+
+        return temp
+
+    def pyname(self, name):
+        if keyword.iskeyword(name):
+            return None
+
+        return name
+
+    def local_name(self, node, name):
+        return f"_{self.contexts[-1 - node.depth].fid}_{name}"
+
+    def consts_name(self, node):
+        return f"_k{self.contexts[-1 - node.depth].fid}"
+
+    def load(self, node, name):
+        if node.depth is not None:
+            return self.local_name(node, name)
+
+        pyname = self.pyname(name)
+
+        if pyname is None:
+            return f"_load({name!r})"
+
+        return pyname
+
+    def store(self, node, name, value):
+        if node.depth is not None:
+            local = self.local_name(node, name)
+
+            if node.depth > 0:
+                self.contexts[-1].nonlocals.add(local)
+                self.contexts[-1 - node.depth].captured.add(local)
+
+            self.emit(f"{local} = {value}")
+            return
+
+        pyname = self.pyname(name)
+
+        if pyname is None:
+            self.emit(f"_S[{name!r}] = {value}")
+        else:
+            self.contexts[-1].globals.add(pyname)
+            self.emit(f"{pyname} = {value}")
+
+    def check_defined(self, node, name, error):
+        if node.depth is None:
+            self.emit(f"if {name!r} not in _S: raise {error}({name!r})")
+        else:
+            self.emit(f"try: {self.local_name(node, name)}")
+            self.emit(f"except _NameError: raise {error}({name!r}) from None")
+
+    def check_const(self, node, name):
+        if node.depth is None:
+            self.emit(f"if {name!r} in _C: raise _const_error({name!r})")
+        elif node.const_slot is not None:
+            self.emit(f"if {node.slot} in {self.consts_name(node)}: raise _const_error({name!r})")
+
+    def assign(self, node, name, value, is_over = False, is_const = False):
+        if is_over:
+            self.check_defined(node, name, "_over_error")
+
+        if is_const and node.depth is None:
+            self.emit(f"_setconst({name!r}, {value})")
+            return
+
+        self.check_const(node, name)
+        self.store(node, name, value)
+
+        if is_const:
+            self.emit(f"{self.consts_name(node)}.add({node.slot})")
+
+    def suite(self, start):
+        if len(self.lines) == start:
+            self.emit("pass")
+
+    def function(self, py_name, statements, node = None):
+        self.counter += 1
+        context = Context(self.counter, node is not None)
+        self.contexts.append(context)
+
+        params = []
+        setup = []
+
+        if node is not None:
+            params = [f"_{context.fid}_{param.value}" for param in node.params]
+
+            # Python rejects repeated parameter names, the last argument wins like in the other engines
+            if len(set(params)) != len(params):
+                setup = [f"{param} = _p{i}" for i, param in enumerate(params)]
+                params = [f"_p{i}" for i in range(len(params))]
+
+            if node.consts_slot is not None:
+                setup.append(f"_k{context.fid} = _set()")
+
+        start = len(self.lines)
+        self.emit(f"def {py_name}({", ".join(params)}):")
+        self.indent += 1
+
+        for line in setup:
+            self.emit(line)
+
+        if statements:
+            for expr in statements[:-1]:
+                self.stmt(expr, None)
+
+            result = self.expr(statements[-1])
+            self.emit(f"return {result}")
+        else:
+            self.emit("return None")
+
+        self.contexts.pop()
+
+        declarations = []
+        if context.globals:
+            declarations.append(f"global {", ".join(sorted(context.globals))}")
+        if context.nonlocals:
+            declarations.append(f"nonlocal {", ".join(sorted(context.nonlocals))}")
+
+        # A nonlocal needs a binding in this def even when the optimizer removed
+        # every assignment to it, a dead one is enough for Python
+        if context.captured:
+            declarations.append(f"if False: {" = ".join(sorted(context.captured))} = None")
+
+        for line in reversed(declarations):
+            self.lines.insert(start + 1, "    " * self.indent + line)
+
+        self.indent -= 1
+
+    def block(self, nodes, target):
+        start = len(self.lines)
+
+        if not nodes:
+            if target is not None:
+                self.emit(f"{target} = None")
+        else:
+            for node in nodes[:-1]:
+                self.stmt(node, None)
+
+            self.stmt(nodes[-1], target)
+
+        self.suite(start)
+
+    def condition(self, node):
+        # Compiles a condition one level deeper and reports whether it needed setup statements
+        mark = len(self.lines)
+        self.indent += 1
+        cond = self.expr(node)
+        self.indent -= 1
+
+        return cond, len(self.lines) > mark
+
+    # Statements
+
+    def stmt(self, node, target):
+        method = getattr(self, f"stmt_{type(node).__name__}", None)
+
+        if method is not None:
+            method(node, target)
+            return
+
+        if type(node) == LiteralNode and target is None:
+            return
+
+        value = self.expr(node)
+
+        if target is not None:
+            self.emit(f"{target} = {value}")
+        else:
+            self.emit(value)
+
+    def value_temp(self, node):
+        # Evaluates node before any checks that come after it
+        value = self.expr(node)
+
+        if type(node) != LiteralNode and value not in self.temps:
+            temp = self.temp()
+            self.emit(f"{temp} = {value}")
+            value = temp
+
+        return value
+
+    def stmt_VarAssignNode(self, node, target):
+        value = self.value_temp(node.value)
+        self.assign(node, node.var_name.value, value, is_over = node.is_over)
+
+        if target is not None:
+            self.emit(f"{target} = {value}")
+
+    def stmt_ConstAssignNode(self, node, target):
+        value = self.value_temp(node.value)
+        self.assign(node, node.const_name.value, value, is_const = True)
+
+        if target is not None:
+            self.emit(f"{target} = {value}")
+
+    def stmt_IfNode(self, node, target):
+        cond = self.expr(node.condition)
+        self.emit(f"if {cond}:")
+        self.indent += 1
+        self.block(node.body, target)
+        self.indent -= 1
+
+        nested = 0
+
+        for elif_cond, elif_body in node.elif_clause:
+            mark = len(self.lines)
+            cond, has_setup = self.condition(elif_cond)
+
+            if has_setup:
+                self.lines.insert(mark, "    " * self.indent + "else:")
+                self.indent += 1
+                nested += 1
+                self.emit(f"if {cond}:")
+            else:
+                self.emit(f"elif {cond}:")
+
+            self.indent += 1
+            self.block(elif_body, target)
+            self.indent -= 1
+
+        if node.else_body:
+            self.emit("else:")
+            self.indent += 1
+            self.block(node.else_body, target)
+            self.indent -= 1
+        elif target is not None:
+            self.emit("else:")
+            self.indent += 1
+            self.emit(f"{target} = None")
+            self.indent -= 1
+
+        self.indent -= nested
+
+    def loop(self, condition, body):
+        mark = len(self.lines)
+        cond, has_setup = self.condition(condition)
+
+        if has_setup:
+            self.lines.insert(mark, "    " * self.indent + "while True:")
+            self.indent += 1
+            self.emit(f"if not {cond}: break")
+        else:
+            self.emit(f"while {cond}:")
+            self.indent += 1
+
+        start = len(self.lines)
+        body()
+        self.suite(start)
+        self.indent -= 1
+
+    def stmt_WhileNode(self, node, target):
+        if target is not None:
+            self.emit(f"{target} = None")
+
+        self.loop(node.condition, lambda: self.block(node.body, target))
+
+    def stmt_ForNode(self, node, target):
+        name = node.var_name.value
+        self.assign(node, name, self.value_temp(node.init))
+
+        def body():
+            for expr in node.body:
+                self.stmt(expr, None)
+
+            update = node.update
+
+            # The loop variable of a for loop is always defined by its initializer
+            if type(update) in (IncrNode, DecrNode) and update.var_name.value == name and update.depth == node.depth:
+                self.step(update, None, is_defined = True)
+            else:
+                self.stmt(update, None)
+
+        self.loop(node.condition, body)
+
+        if target is not None:
+            self.emit(f"{target} = None")
+
+    def stmt_FunctionDefNode(self, node, target):
+        py_name = f"_fn{self.counter + 1}"
+        params = [param.value for param in node.params]
+
+        self.function(py_name, node.body, node)
+
+        self.nodes.append(node)
+        index = len(self.nodes) - 1
+
+        if node.memo_size is not None:
+            self.assign(node, node.name, f"_Function({node.name!r}, {params!r}, {py_name}, _N[{index}], memo_size = {node.memo_size})")
+        else:
+            self.assign(node, node.name, f"_Function({node.name!r}, {params!r}, {py_name}, _N[{index}])")
+
+        if target is not None:
+            self.emit(f"{target} = None")
+
+    def stmt_IncrNode(self, node, target):
+        self.step(node, target)
+
+    def stmt_DecrNode(self, node, target):
+        self.step(node, target)
+
+    def step(self, node, target, is_defined = False):
+        name = node.var_name.value
+        sign = "+" if type(node) == IncrNode else "-"
+        current = self.load(node, name)
+
+        if not is_defined:
+            self.check_defined(node, name, "_undefined_error")
+
+        if target is not None and not node.is_prefix:
+            old = self.temp()
+            self.emit(f"{old} = {current}")
+            current = old
+
+        self.check_const(node, name)
+        self.store(node, name, f"{current} {sign} 1")
+
+        if target is not None:
+            self.emit(f"{target} = {current if not node.is_prefix else self.load(node, name)}")
+
+    def stmt_return(self, node):
+        value = "None"
+
+        if len(node.args) == 1:
+            value = self.expr(node.args[0])
+        elif node.args:
+            # Later arguments are still evaluated, after the returned one
+            value = self.value_temp(node.args[0])
+
+            for arg in node.args[1:]:
+                self.stmt(arg, None)
+
+        if self.contexts[-1].is_pyrite:
+            self.emit(f"return {value}")
+        else:
+            self.emit(f"raise _ReturnSignal({value})")
+
+    # Expressions
+
+    def expr(self, node):
+        method = getattr(self, f"expr_{type(node).__name__}", None)
+
+        if method is not None:
+            return method(node)
+
+        # Statement nodes used as values are hoisted into a temporary
+        temp = self.temp()
+        self.stmt(node, temp)
+        return temp
+
+    def exprs(self, nodes):
+        # Evaluates nodes in order, freezing earlier values into temporaries
+        # whenever a later node needs setup statements of its own
+        values = []
+
+        for node in nodes:
+            mark = len(self.lines)
+            value = self.expr(node)
+
+            if len(self.lines) > mark:
+                for i in range(len(values)):
+                    if values[i] not in self.temps:
+                        temp = self.temp()
+                        self.lines.insert(mark, "    " * self.indent + f"{temp} = {values[i]}")
+                        mark += 1
+                        values[i] = temp
+
+            values.append(value)
+
+        return values
+
+    def expr_LiteralNode(self, node):
+        return repr(node.token.value)
+
+    def expr_VarAccessNode(self, node):
+        return self.load(node, node.var_name.value)
+
+    def expr_ListNode(self, node):
+        return f"[{", ".join(self.exprs(node.elements))}]"
+
+    def expr_ListAccessNode(self, node):
+        list_val, index = self.exprs([node.name, node.index])
+
+        return f"_index({list_val}, {index})"
+
+    def expr_BinOpNode(self, node):
+        left, right = self.exprs([node.left, node.right])
+        op_type = node.op.type
+
+        if op_type in INLINE_OPS:
+            return f"({left} {INLINE_OPS[op_type]} {right})"
+
+        if op_type in HELPER_OPS:
+            return f"{HELPER_OPS[op_type]}({left}, {right})"
+
+        if op_type == T_AVERAGE:
+            return f"(({left} + {right}) / 2)"
+
+        if op_type == T_APPROX:
+            return f"(_abs({left} - {right}) <= 0.01)"
+
+        raise Error("Runtime Error", f"Unsupported operator '{op_type}'")
+
+    def expr_UnaryOpNode(self, node):
+        value = self.expr(node.right)
+
+        if node.op.type == T_MINUS:
+            return f"(-{value})"
+
+        if node.op.type == T_NOT:
+            return f"(not {value})"
+
+        return value
+
+    def expr_FunctionCallNode(self, node):
+        func_type = node.name.type
+
+        if func_type == T_RETURN:
+            self.stmt_return(node)
+            return "None"
+
+        args = self.exprs(node.args)
+
+        if func_type == T_EXEC and len(args) == 1:
+            return f"_print(_str({args[0]}))"
+
+        if func_type in INLINE_BUILTINS and len(args) == 1:
+            return f"{INLINE_BUILTINS[func_type]}({args[0]})"
+
+        if func_type == T_POW and len(args) == 2:
+            return f"({args[0]} ** {args[1]})"
+
+        if func_type in BUILTINS:
+            return f"_B[{func_type!r}]([{", ".join(args)}])"
+
+        name = node.name.value
+        return f"_call([{", ".join(args)}], {self.load(node, name)}, {name!r})"
+
+    def expr_SpawnNode(self, node):
+        call = node.call
+        args = self.exprs(call.args)
+        name = call.name.value
+
+        return f"_spawn([{", ".join(args)}], {self.load(call, name)}, {name!r})"
+
+    def expr_AwaitNode(self, node):
+        return f"_wait({self.expr(node.value)})"
+
+    def expr_ImportNode(self, node):
+        return f"_import({node.module!r}, {node.names!r})"
+
+# Transpiled Interpreter
+# Compiles each statement to a Python code object once with compile() and runs it.
+
+class TranspiledInterpreter:
+    def __init__(self):
+        self.symbol_table = SymbolTable()
+        self.nodes = []
+        self.symbol_table.symbols["__builtins__"] = self.helpers()
+
+        # Imported modules, and the file being run to find them next to
+        self.modules = Modules()
+        self.path = None
+
+    def visit(self, node):
+        source = Transpiler(self.nodes).transpile([node])
+
+        return self.run_code(compile(source, "<pyrite>", "exec"))
+
+    # Prepared Programs
+    # Code objects find their nodes by index in _N, a fresh engine starts
+    # with an empty list and gets the ones they were transpiled with
+
+    def prepare(self, statements):
+        nodes = []
+        codes = tuple(compile(Transpiler(nodes).transpile([stmt]), "<pyrite>", "exec") for stmt in statements)
+
+        return (codes, tuple(nodes))
+
+    def run_prepared(self, prepared):
+        codes, nodes = prepared
+        self.nodes.extend(nodes)
+
+        result = None
+        for code in codes:
+            result = self.run_code(code)
+
+        return result
+
+    def run_code(self, code):
+        symbols = self.symbol_table.symbols
+
+        exec(code, symbols)
+        main = symbols.pop("_main")
+
+        try:
+            return main()
+        except NameError as e:
+            # UnboundLocalError leaves e.name unset, so fall back to the message
+            name = e.name or str(e).split("'")[1]
+            raise Error("Runtime Error", f"'{LOCAL_NAME.sub("", name)}' not defined") from None
+
+    def helpers(self):
+        table = self.symbol_table
+        symbols = table.symbols
+        constants = table.constants
+
+        def const_error(name):
+            return Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+        def over_error(name):
+            return Error("Runtime Error", f"Cannot use 'over' to reassign undefined variable '{name}'")
+
+        def undefined_error(name):
+            return Error("Runtime Error", f"Undefined variable '{name}'")
+
+        def load(name):
+            if name not in symbols:
+                raise Error("Runtime Error", f"'{name}' not defined")
+
+            return symbols[name]
+
+        def function(name, params, body, node, memo_size = None):
+            return Function(name, params, body, memo_size = memo_size, globals = table, node = node)
+
+        def setconst(name, value):
+            table.set(name, value, is_const = True)
+            return value
+
+        def call(args, func, name):
+            if type(func) != Function:
+                raise Error("Runtime Error", f"'{name}' is not a function")
+
+            memo = func.memo
+
+            if memo is not None:
+                key = memo.key(func, args)
+                result = memo.get(key)
+
+                if result is UNSET:
+                    result = invoke(args, func)
+                    memo.put(key, result)
+
+                return result
+
+            if len(args) == len(func.params):
+                return func.body(*args)
+
+            return invoke(args, func)
+
+        def invoke(args, func):
+            count = len(func.params)
+
+            if len(args) == count:
+                return func.body(*args)
+
+            if len(args) < count:
+                raise Error("Runtime Error", f"'{func.name}' expects {count} arguments, got {len(args)}")
+
+            return func.body(*args[:count])
+
+        return {
+            "_S": symbols,
+            "_C": constants,
+            "_B": BUILTINS,
+            "_ReturnSignal": ReturnSignal,
+            "_NameError": NameError,
+            "_const_error": const_error,
+            "_over_error": over_error,
+            "_undefined_error": undefined_error,
+            "_load": load,
+            "_setconst": setconst,
+            "_import": lambda name, names: import_module(self, name, names),
+            "_spawn": lambda args, func, name: tasks.spawn(func, args, name),
+            "_wait": tasks.wait,
+            "_Function": function,
+            "_N": self.nodes,
+            "_call": call,
+            "_index": list_access,
+            "_div": op_div,
+            "_fdiv": op_fdiv,
+            "_mod": op_mod,
+            "_and": lambda left, right: left and right,
+            "_or": lambda left, right: left or right,
+            "_print": output.print_line,
+            "_str": str,
+            "_int": int,
+            "_float": float,
+            "_bool": bool,
+            "_abs": abs,
+            "_len": len,
+            "_set": set,
+            "_typename": lambda value: str(type(value).__name__)
+        }
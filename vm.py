@@ -0,0 +1,434 @@
+import weakref
+
+from tokens import *
+from error import Error
+from interpreter import SymbolTable, ReturnSignal
+from runtime import UNSET, Function, BINARY_OPS, BUILTINS, list_access, input_prompt, input_value
+from modules import Modules, import_module
+from bytecode import *
+import tasks
+
+BINARY_FUNCS = tuple(BINARY_OPS[op_type] for op_type in BINARY_ORDER)
+BUILTIN_FUNCS = tuple(BUILTINS[func_type] for func_type in BUILTIN_ORDER)
+ARGC_MASK = MAX_ARGS
+INPUT_BUILTIN = BUILTIN_ORDER.index(T_INPUT)
+
+# CodeObjects of functions defined on the other engines, by their FunctionDefNode
+COMPILED = weakref.WeakKeyDictionary()
+
+def vm_function(func):
+    # func itself, or a copy running bytecode compiled from its definition
+    if type(func.body) == CodeObject:
+        return func
+
+    node = func.node
+
+    if node is None:
+        raise Error("Runtime Error", f"'{func.name}' has no definition to compile")
+
+    if node.depth is not None and func.closure is None:
+        raise Error("Runtime Error", f"'{func.name}' uses variables of an enclosing function and cannot run as a task on this engine")
+
+    code_obj = COMPILED.get(node)
+
+    if code_obj is None:
+        code_obj = Compiler(node.name, [param.value for param in node.params]).compile_function(node)
+        COMPILED[node] = code_obj
+
+    copy = Function(func.name, func.params, code_obj, func.closure, code_obj.nslots, code_obj.param_slots, code_obj.consts_slot, None, func.globals, node)
+    copy.memo = func.memo
+
+    return copy
+
+# Virtual Machine
+# Runs CodeObjects in a single dispatch loop. Pyrite calls push a frame onto
+# an explicit frame list instead of recursing on the Python stack, so
+# recursion depth is only limited by memory and max_depth. Locals live in
+# the slot list of the current frame (None at the top level).
+#
+# The loop is a generator so a task (see tasks.py) can be suspended at any
+# depth of calls: it yields at 'await', 'input' and loop back-edges. Code
+# that is not a task never yields and runs to the end in one step.
+
+class VM:
+    # Deepest chain of Pyrite calls allowed, about 300 bytes of memory each
+    max_depth = 100000
+
+    def __init__(self):
+        self.symbol_table = SymbolTable()
+
+        # Imported modules, and the file being run to find them next to
+        self.modules = Modules()
+        self.path = None
+
+    def visit(self, node):
+        return self.execute(Compiler().compile_module([node]))
+
+    # Prepared Programs
+    # CodeObjects hold no engine state, one compiled module runs on every VM
+
+    def prepare(self, statements):
+        return Compiler().compile_module(list(statements))
+
+    def run_prepared(self, code_obj):
+        return self.execute(code_obj)
+
+    def execute(self, code_obj):
+        try:
+            next(self.steps(code_obj))
+        except StopIteration as stop:
+            return stop.value
+
+    def run_task(self, func, args):
+        func = vm_function(func)
+        memo = func.memo
+
+        if memo is not None:
+            key = memo.key(func, args)
+            result = memo.get(key)
+
+            if result is not UNSET:
+                return result
+
+        result = yield from self.steps(func.body, func, args)
+
+        if memo is not None:
+            memo.put(key, result)
+
+        return result
+
+    def steps(self, code_obj, func = None, args = None):
+        # Runs code_obj, or func's code called with args as a task
+        in_task = func is not None
+        yield_every = tasks.yield_every
+        ticks = 0
+
+        # Globals of the running function's module, switched by calls and returns
+        table = func.globals if in_task else self.symbol_table
+        symbols = table.symbols
+        constants = table.constants
+        set_symbol = table.set
+        max_depth = self.max_depth
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+
+        # Saved caller state: (code object, pc, stack base, locals, the
+        # (memo, key) to cache the callee's result under if it is a memo func,
+        # and the caller's globals)
+        frames = []
+
+        current = code_obj
+        code = code_obj.code
+        consts = code_obj.consts
+        names = code_obj.names
+        pc = 0
+        base = 0
+        local_slots = func.new_frame(args) if in_task else None
+
+        while True:
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+
+            if op == LOAD_FAST:
+                value = local_slots[arg]
+
+                if value is UNSET:
+                    raise Error("Runtime Error", f"'{current.varnames[arg]}' not defined")
+
+                push(value)
+
+            elif op == STORE_FAST:
+                local_slots[arg] = stack[-1]
+
+            elif op == LOAD_NAME:
+                try:
+                    push(symbols[names[arg]])
+                except KeyError:
+                    raise Error("Runtime Error", f"'{names[arg]}' not defined") from None
+
+            elif op == LOAD_CONST:
+                push(consts[arg])
+
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+
+            elif op == JUMP:
+                # Loop back-edges are where a task gives the others a turn
+                if in_task and arg < pc:
+                    ticks += 1
+
+                    if ticks == yield_every:
+                        ticks = 0
+                        yield None
+
+                pc = arg
+
+            elif op == POP:
+                pop()
+
+            elif op == BINARY_ADD:
+                right = pop()
+                stack[-1] = stack[-1] + right
+            elif op == BINARY_LT:
+                right = pop()
+                stack[-1] = stack[-1] < right
+            elif op == BINARY_SUB:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif op == BINARY_MUL:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif op == BINARY_EQ:
+                right = pop()
+                stack[-1] = stack[-1] == right
+            elif op == BINARY_LTE:
+                right = pop()
+                stack[-1] = stack[-1] <= right
+            elif op == BINARY_GT:
+                right = pop()
+                stack[-1] = stack[-1] > right
+            elif op == BINARY_GTE:
+                right = pop()
+                stack[-1] = stack[-1] >= right
+            elif op == BINARY_NEQ:
+                right = pop()
+                stack[-1] = stack[-1] != right
+            elif op == BINARY_OP:
+                right = pop()
+                stack[-1] = BINARY_FUNCS[arg](stack[-1], right)
+
+            elif op == STORE_NAME:
+                name = names[arg]
+
+                if name in constants:
+                    raise Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+                symbols[name] = stack[-1]
+
+            elif op == STORE_OVER:
+                name = names[arg]
+
+                if name not in symbols:
+                    raise Error("Runtime Error", f"Cannot use 'over' to reassign undefined variable '{name}'")
+
+                if name in constants:
+                    raise Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+                symbols[name] = stack[-1]
+
+            elif op == STORE_CONST:
+                set_symbol(names[arg], stack[-1], is_const = True)
+
+            elif op == INCR or op == INCR_PREFIX or op == DECR or op == DECR_PREFIX:
+                name = names[arg]
+
+                if name not in symbols:
+                    raise Error("Runtime Error", f"Undefined variable '{name}'")
+
+                current_val = symbols[name]
+                new_val = current_val + 1 if op == INCR or op == INCR_PREFIX else current_val - 1
+
+                if name in constants:
+                    raise Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+                symbols[name] = new_val
+                push(new_val if op == INCR_PREFIX or op == DECR_PREFIX else current_val)
+
+            elif op == INCR_FAST or op == DECR_FAST:
+                current_val = local_slots[arg]
+
+                if current_val is UNSET:
+                    raise Error("Runtime Error", f"Undefined variable '{current.varnames[arg]}'")
+
+                local_slots[arg] = current_val + 1 if op == INCR_FAST else current_val - 1
+                push(current_val)
+
+            elif op == LOAD_LOCAL:
+                depth, slot, const_slot, name = current.refs[arg]
+                frame = local_slots
+
+                for _ in range(depth):
+                    frame = frame[0]
+
+                if frame[slot] is UNSET:
+                    raise Error("Runtime Error", f"'{name}' not defined")
+
+                push(frame[slot])
+
+            elif op == STORE_LOCAL or op == STORE_LOCAL_OVER or op == STORE_LOCAL_CONST or op == STEP_LOCAL:
+                ref = arg >> 2 if op == STEP_LOCAL else arg
+                depth, slot, const_slot, name = current.refs[ref]
+                frame = local_slots
+
+                for _ in range(depth):
+                    frame = frame[0]
+
+                if op == STEP_LOCAL:
+                    current_val = frame[slot]
+
+                    if current_val is UNSET:
+                        raise Error("Runtime Error", f"Undefined variable '{name}'")
+
+                    new_val = current_val - 1 if arg & STEP_DECR else current_val + 1
+                    push(new_val if arg & STEP_PREFIX else current_val)
+                else:
+                    if op == STORE_LOCAL_OVER and frame[slot] is UNSET:
+                        raise Error("Runtime Error", f"Cannot use 'over' to reassign undefined variable '{name}'")
+
+                    new_val = stack[-1]
+
+                if const_slot != -1:
+                    if slot in frame[const_slot]:
+                        raise Error("Runtime Error", f"Cannot reassign constant '{name}'")
+
+                    if op == STORE_LOCAL_CONST:
+                        frame[const_slot].add(slot)
+
+                frame[slot] = new_val
+
+            elif op == INDEX:
+                index = pop()
+                stack[-1] = list_access(stack[-1], index)
+
+            elif op == CALL_BUILTIN:
+                argc = arg & ARGC_MASK
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+
+                if in_task and arg >> ARGC_BITS == INPUT_BUILTIN:
+                    push(input_value((yield tasks.Input(input_prompt(args)))))
+                else:
+                    push(BUILTIN_FUNCS[arg >> ARGC_BITS](args))
+
+            elif op == CALL_FUNCTION or op == TAIL_CALL:
+                func = pop()
+                argc = arg & ARGC_MASK
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+
+                if type(func) != Function:
+                    raise Error("Runtime Error", f"'{names[arg >> ARGC_BITS]}' is not a function")
+
+                # Functions from other engines reach tasks, and pmap results
+                if type(func.body) is not CodeObject:
+                    func = vm_function(func)
+
+                memo = func.memo
+                memo_entry = None
+
+                if memo is not None:
+                    key = memo.key(func, args)
+                    result = memo.get(key)
+
+                    if result is not UNSET:
+                        push(result)
+                        continue
+
+                    memo_entry = (memo, key)
+
+                # A tail call replaces the current frame, the callee returns to
+                # our caller. A memo func has to see its result, so it never is
+                if op == TAIL_CALL and memo is None:
+                    local_slots = func.new_frame(args)
+                    del stack[base:]
+                else:
+                    if len(frames) >= max_depth:
+                        raise Error("Runtime Error", f"Maximum recursion depth of {max_depth} exceeded")
+
+                    new_slots = func.new_frame(args)
+                    frames.append((current, pc, base, local_slots, memo_entry, table))
+
+                    base = len(stack)
+                    local_slots = new_slots
+
+                current = func.body
+                code = current.code
+                consts = current.consts
+                names = current.names
+                pc = 0
+
+                # A function imported from a module uses its globals
+                if func.globals is not table:
+                    table = func.globals
+                    symbols = table.symbols
+                    constants = table.constants
+                    set_symbol = table.set
+
+            elif op == RETURN_VALUE:
+                result = pop()
+
+                if not frames:
+                    # A return statement outside of any function
+                    if pc != len(code) and not in_task:
+                        raise ReturnSignal(result)
+
+                    return result
+
+                del stack[base:]
+                current, pc, base, local_slots, memo_entry, caller_table = frames.pop()
+                code = current.code
+                consts = current.consts
+                names = current.names
+
+                if caller_table is not table:
+                    table = caller_table
+                    symbols = table.symbols
+                    constants = table.constants
+                    set_symbol = table.set
+
+                if memo_entry is not None:
+                    memo_entry[0].put(memo_entry[1], result)
+
+                push(result)
+
+            elif op == BUILD_LIST:
+                if arg == 0:
+                    push([])
+                else:
+                    elements = stack[len(stack) - arg:]
+                    del stack[len(stack) - arg:]
+                    push(elements)
+
+            elif op == MAKE_FUNCTION:
+                callee = consts[arg]
+
+                push(Function(callee.name, callee.params, callee, local_slots, callee.nslots, callee.param_slots, callee.consts_slot, callee.memo_size, table, callee.node))
+
+            elif op == IMPORT_NAME:
+                argc = arg & ARGC_MASK
+                import_names = None
+
+                if argc:
+                    import_names = stack[len(stack) - argc:]
+                    del stack[len(stack) - argc:]
+
+                push(import_module(self, names[arg >> ARGC_BITS], import_names))
+
+            elif op == SPAWN:
+                func = pop()
+                argc = arg & ARGC_MASK
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+
+                push(tasks.spawn(func, args, names[arg >> ARGC_BITS]))
+
+            elif op == AWAIT:
+                if not in_task:
+                    stack[-1] = tasks.wait(stack[-1])
+                elif type(stack[-1]) != tasks.Task:
+                    raise Error("Runtime Error", "await expects a task")
+                else:
+                    push((yield pop()))
+
+            elif op == UNARY_NEG:
+                stack[-1] = -stack[-1]
+
+            elif op == UNARY_NOT:
+                stack[-1] = not stack[-1]
+
+            else:
+                raise Error("Runtime Error", f"Unknown opcode {op}")